@@ -1,22 +1,66 @@
-from googleapiclient.discovery import build
-from oauth2client.service_account import ServiceAccountCredentials
 import dash
-from dash.dependencies import Output, Input
+import flask
+from dash.dependencies import Output, Input, State, ClientsideFunction
+from dash.exceptions import PreventUpdate
 import dash_core_components as dcc
 import dash_html_components as html
 import plotly
 import random
-import plotly.graph_objects as go
-from collections import deque
-from plotly import subplots
-import pandas as pd
-import numpy as np
-from datetime import datetime
+from collections import deque, OrderedDict
+from datetime import datetime, timedelta
 import os
+import sys
+import zlib
+import hashlib
+import hmac
+import stat
+import threading
+import time
+import logging
+import functools
+import asyncio
+import pickle
+import json
+import urllib.parse
+import io
+import struct
+import tempfile
+import shutil
+import fcntl
+import argparse
+import importlib
+import types
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as futures_timeout
 
 
 
-import psycopg2
+# Modules that only some code paths use are bound here but imported on first attribute access, so a worker that has not
+# drawn a figure or called GA yet has not paid for them. prewarm() loads them all up front, e.g. in a preloading master.
+# The import itself is a normal one, so threads touching a module at the same time wait on the import lock instead of
+# seeing it half executed (importlib's LazyLoader only guards against that from Python 3.12).
+class LazyModule(types.ModuleType):
+	def __getattr__(self, attr):
+		module = importlib.import_module(self.__name__)
+		self.__dict__.update(module.__dict__)
+		return getattr(module, attr)
+
+def lazy_import(name):
+	if name in sys.modules:
+		return sys.modules[name]
+	return LazyModule(name)
+
+def load_modules(*modules):
+	for module in modules:
+		getattr(module, '__file__', None)
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+pio = lazy_import('plotly.io')
+subplots = lazy_import('plotly.subplots')
+discovery = lazy_import('googleapiclient.discovery')
+service_account = lazy_import('oauth2client.service_account')
+psycopg2 = lazy_import('psycopg2')
 
 # DATABASE_URL = os.environ['DATABASE_URL']			for Heroku Hosting Purpose
 
@@ -33,123 +77,1999 @@ column_names_pageviews = ['pageviews','pageviewsPerSession','uniquePageviews','a
 column_names_users = ['visitorType','users']
 column_names_overall = ['Users','Sessions','Avg. Session Duration','Pageviews','Pageviews Per Session','Bounce Rate','Avg. Time On Page','Hits', 'Unique Pageviews']
 
-df = pd.DataFrame(columns=column_names_real_time_geo)
+logger = logging.getLogger(__name__)
+
+OVERVIEW_WORKERS = int(os.environ.get('OVERVIEW_WORKERS', '6'))
+OVERVIEW_TIMEOUT = float(os.environ.get('OVERVIEW_TIMEOUT', '30'))
+
+overview_executor = ThreadPoolExecutor(max_workers=OVERVIEW_WORKERS, thread_name_prefix='overview')
+
+# 'thread' runs the ingestion scheduler inside the web process, 'process' expects `python app.py ingest` to run separately,
+# and 'inline' keeps the old behaviour of fetching missing days from inside the callbacks.
+INGEST_MODE = os.environ.get('INGEST_MODE', 'thread')
+INGEST_INTERVAL = float(os.environ.get('INGEST_INTERVAL', '3600'))
+INGEST_RETRIES = int(os.environ.get('INGEST_RETRIES', '3'))
+INGEST_BACKOFF = float(os.environ.get('INGEST_BACKOFF', '30'))
+
+METRICS_BUCKETS = [float(i) for i in os.environ.get('METRICS_BUCKETS', '0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30').split(',')]
+
+# Process-wide counters and latency histograms, rendered in the Prometheus text format at /metrics. Each gunicorn worker
+# keeps its own, so scrape the workers separately or sum them on the collector side.
+class Metrics:
+	def __init__(self, buckets):
+		self.buckets = sorted(buckets)
+		self.counters = OrderedDict()
+		self.histograms = OrderedDict()
+		self.gauges = OrderedDict()
+		self.help = {}
+		self.lock = threading.Lock()
+
+	def describe(self, name, kind, text):
+		self.help[name] = (kind, text)
+
+	def inc(self, name, value = 1, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			self.counters[key] = self.counters.get(key, 0) + value
+
+	def set(self, name, value, **labels):
+		with self.lock:
+			self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+	def observe(self, name, seconds, **labels):
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			histogram = self.histograms.get(key)
+			if histogram is None:
+				histogram = self.histograms[key] = [[0]*len(self.buckets), 0.0, 0]
+			for i, bound in enumerate(self.buckets):
+				if seconds <= bound:
+					histogram[0][i] += 1
+			histogram[1] += seconds
+			histogram[2] += 1
+
+	@contextmanager
+	def timer(self, name, **labels):
+		start = time.time()
+		try:
+			yield
+		finally:
+			self.observe(name, time.time() - start, **labels)
+
+	def render(self):
+		def format_labels(labels, extra = ()):
+			labels = list(labels) + list(extra)
+			if len(labels) == 0:
+				return ''
+			return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels) + '}'
+		lines = []
+		described = set()
+		def header(name):
+			if name in self.help and name not in described:
+				described.add(name)
+				lines.append('# HELP {0} {1}'.format(name, self.help[name][1]))
+				lines.append('# TYPE {0} {1}'.format(name, self.help[name][0]))
+		with self.lock:
+			for (name, labels), value in sorted(self.counters.items()) + sorted(self.gauges.items()):
+				header(name)
+				lines.append('{0}{1} {2}'.format(name, format_labels(labels), value))
+			for (name, labels), (counts, total, count) in sorted(self.histograms.items()):
+				header(name)
+				for bound, bucket in zip(self.buckets, counts):
+					lines.append('{0}_bucket{1} {2}'.format(name, format_labels(labels, [('le', repr(bound))]), bucket))
+				lines.append('{0}_bucket{1} {2}'.format(name, format_labels(labels, [('le', '+Inf')]), count))
+				lines.append('{0}_sum{1} {2}'.format(name, format_labels(labels), total))
+				lines.append('{0}_count{1} {2}'.format(name, format_labels(labels), count))
+		return '\n'.join(lines) + '\n'
+
+metrics = Metrics(METRICS_BUCKETS)
+metrics.describe('dash_callback_seconds', 'histogram', 'Time spent in a Dash callback.')
+metrics.describe('dash_callback_errors_total', 'counter', 'Dash callbacks that raised.')
+metrics.describe('ga_request_seconds', 'histogram', 'Duration of a Google Analytics API request, by report.')
+metrics.describe('ga_requests_total', 'counter', 'Google Analytics API requests made, by report.')
+metrics.describe('ga_errors_total', 'counter', 'Google Analytics API requests that failed, by report.')
+metrics.describe('ga_retries_total', 'counter', 'Google Analytics API requests retried after a rate limit or server error.')
+metrics.describe('ga_coalesced_total', 'counter', 'Google Analytics API requests answered by an identical request already in flight.')
+metrics.describe('ga_throttle_seconds', 'histogram', 'Time a Google Analytics API request waited for the rate limiter.')
+metrics.describe('ga_quota_remaining', 'gauge', 'Google Analytics API requests left in the daily quota of a view in this process.')
+metrics.describe('db_query_seconds', 'histogram', 'Duration of a Postgres statement, by statement type.')
+metrics.describe('db_pool_wait_seconds', 'histogram', 'Time spent waiting for a pooled database connection.')
+metrics.describe('db_pool_timeouts_total', 'counter', 'Requests that gave up waiting for a database connection.')
+metrics.describe('db_pool_connections', 'gauge', 'Pooled database connections, by state.')
+metrics.describe('access_wait_seconds', 'histogram', 'Time a GA or database call from a callback waited for a free slot, by kind.')
+metrics.describe('access_timeouts_total', 'counter', 'GA or database calls from callbacks that missed their deadline, by kind.')
+metrics.describe('access_calls_in_flight', 'gauge', 'GA or database calls from callbacks running right now, by kind.')
+metrics.describe('cache_requests_total', 'counter', 'Cache lookups by cache, key kind and result (hit, shared, stale, miss).')
+metrics.describe('shared_cache_errors_total', 'counter', 'Shared cache backend operations that failed, by cache.')
+metrics.describe('cache_bytes', 'gauge', 'Pickled size of everything held in a cache.')
+
+# Put under @app.callback so the latency of every callback is recorded; PreventUpdate is not an error.
+def timed(function):
+	@functools.wraps(function)
+	def wrapper(*args, **kwargs):
+		start = time.time()
+		try:
+			return function(*args, **kwargs)
+		except PreventUpdate:
+			raise
+		except Exception:
+			metrics.inc('dash_callback_errors_total', callback=function.__name__)
+			raise
+		finally:
+			metrics.observe('dash_callback_seconds', time.time() - start, callback=function.__name__)
+	return wrapper
+
+SCOPES = ['https://www.googleapis.com/auth/analytics.readonly']
+KEY_FILE_LOCATION = 'YOUR CREDENTIAL FILE LOCATION'
+VIEW_ID = 'YOUR VIEW ID'
+# Views to report on, comma separated. VIEW_ID keeps the original table names; every other view gets tables of its own.
+VIEW_IDS = [i.strip() for i in os.environ.get('VIEW_IDS', VIEW_ID).split(',') if i.strip()]
+ALL_VIEWS = 'all'
+DEFAULT_VIEW = ALL_VIEWS if len(VIEW_IDS) > 1 else VIEW_IDS[0]
+VIEW_WORKERS = int(os.environ.get('VIEW_WORKERS', '8'))
+
+view_executor = ThreadPoolExecutor(max_workers=VIEW_WORKERS, thread_name_prefix='views')
+
+# The view a callback was asked for comes from the browser, and every view gets tables, GA requests, a rate limiter and
+# cache entries of its own, so anything but ALL_VIEWS or a configured view is dropped before it reaches them.
+def check_view(view):
+	if view != ALL_VIEWS and view not in VIEW_IDS:
+		raise PreventUpdate
+	return view
+
+def get_views(view):
+	if view == ALL_VIEWS:
+		return VIEW_IDS
+	return [check_view(view)]
+
+# Runs function(view) for every view selected by `view` at the same time, so N views take about as long as the slowest.
+def map_views(function, view):
+	views = get_views(view)
+	if len(views) == 1:
+		return [function(views[0])]
+	return list(view_executor.map(function, views))
+
+def get_table_name(table, view = VIEW_ID):
+	if view == VIEW_ID:
+		return table
+	return '{0}_{1}'.format(table, ''.join(i for i in view if i.isalnum()))
+DISCOVERY_CACHE_DIR = os.environ.get('DISCOVERY_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.discovery_cache'))
+
+# Implements the get/set interface of googleapiclient.discovery_cache.base.Cache without importing it at start-up.
+class DiscoveryCache:
+	def __init__(self, directory):
+		self.directory = directory
+
+	def path(self, url):
+		return os.path.join(self.directory, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+	def get(self, url):
+		try:
+			with open(self.path(url)) as f:
+				return f.read()
+		except (IOError, OSError):
+			return None
+
+	def set(self, url, content):
+		try:
+			os.makedirs(self.directory, exist_ok=True)
+			tmp = self.path(url) + '.{0}.tmp'.format(os.getpid())
+			with open(tmp, 'w') as f:
+				f.write(content)
+			os.replace(tmp, self.path(url))
+		except (IOError, OSError):
+			pass
+
+# Credentials are shared by the whole process so the access token is minted once and refreshed in place.
+# httplib2 is not thread-safe, so every thread builds its own service objects on top of them.
+credentials_cache = {}
+credentials_lock = threading.Lock()
+local_services = threading.local()
+
+def get_credentials(scopes, key_file_location):
+	key = (tuple(scopes), key_file_location)
+	with credentials_lock:
+		if key not in credentials_cache:
+			credentials_cache[key] = service_account.ServiceAccountCredentials.from_json_keyfile_name(key_file_location, scopes=scopes)
+		return credentials_cache[key]
 
 def get_service(api_name, api_version, scopes, key_file_location):
-	credentials = ServiceAccountCredentials.from_json_keyfile_name(key_file_location, scopes=scopes)
-	service = build(api_name, api_version, credentials=credentials)
-	return service
+	services = getattr(local_services, 'services', None)
+	if services is None:
+		services = local_services.services = {}
+	key = (api_name, api_version, tuple(scopes), key_file_location)
+	if key not in services:
+		credentials = get_credentials(scopes, key_file_location)
+		services[key] = discovery.build(api_name, api_version, credentials=credentials, cache=DiscoveryCache(DISCOVERY_CACHE_DIR))
+	return services[key]
+
+def get_analytics():
+	return get_service('analyticsreporting', 'v4', SCOPES, KEY_FILE_LOCATION)
+
+def get_realtime_service():
+	return get_service('analytics', 'v3', SCOPES, KEY_FILE_LOCATION)
+
+# GA allows 10 requests per second and 10,000 requests per day for each view. The limits below apply to each view in each
+# process, so by default every process gets an equal share: one for each of the WEB_CONCURRENCY web workers and one for a
+# separate `python app.py ingest` or `backfill` run. Set GA_PROCESSES when more processes on the host call GA.
+GA_PROCESSES = max(1, int(os.environ.get('GA_PROCESSES', int(os.environ.get('WEB_CONCURRENCY', '1')) + 1)))
+GA_QPS = float(os.environ.get('GA_QPS', 10/GA_PROCESSES))
+GA_BURST = int(os.environ.get('GA_BURST', max(1, 10//GA_PROCESSES)))
+GA_DAILY_QUOTA = int(os.environ.get('GA_DAILY_QUOTA', 10000//GA_PROCESSES))
+GA_RETRIES = int(os.environ.get('GA_RETRIES', '5'))
+GA_BACKOFF = float(os.environ.get('GA_BACKOFF', '1'))
+
+class QuotaExceeded(Exception):
+	pass
+
+# Token bucket holding up to `burst` requests and refilled at `rate` per second. The daily count rolls over at midnight
+# US Pacific time like GA's own; it uses UTC-8 all year, so during daylight saving time it rolls over an hour late.
+class RateLimiter:
+	def __init__(self, rate, burst, daily_quota):
+		self.rate = rate
+		self.burst = burst
+		self.daily_quota = daily_quota
+		self.tokens = float(burst)
+		self.updated = time.time()
+		self.day = None
+		self.used = 0
+		self.lock = threading.Lock()
+
+	def get_day(self):
+		return time.strftime('%Y-%m-%d', time.gmtime(time.time() - 8*3600))
+
+	def acquire(self):
+		start = time.time()
+		while True:
+			with self.lock:
+				now = time.time()
+				if self.day != self.get_day():
+					self.day, self.used = self.get_day(), 0
+				if self.used >= self.daily_quota:
+					raise QuotaExceeded('Daily GA quota of {0} requests used up'.format(self.daily_quota))
+				self.tokens = min(self.burst, self.tokens + (now - self.updated)*self.rate)
+				self.updated = now
+				if self.tokens >= 1:
+					self.tokens -= 1
+					self.used += 1
+					metrics.observe('ga_throttle_seconds', now - start)
+					return
+				wait = (1 - self.tokens)/self.rate
+			time.sleep(wait)
+
+	def remaining(self):
+		with self.lock:
+			if self.day != self.get_day():
+				return self.daily_quota
+			return self.daily_quota - self.used
+
+# Identical requests made while one is already in flight wait for it and share its response (or its error).
+class SingleFlight:
+	def __init__(self):
+		self.calls = {}
+		self.lock = threading.Lock()
+
+	def do(self, key, function):
+		with self.lock:
+			call = self.calls.get(key)
+			leader = call is None
+			if leader:
+				call = self.calls[key] = {'done': threading.Event(), 'value': None, 'error': None}
+		if not leader:
+			call['done'].wait()
+			if call['error'] is not None:
+				raise call['error']
+			return call['value'], False
+		try:
+			call['value'] = function()
+			return call['value'], True
+		except Exception as e:
+			call['error'] = e
+			raise
+		finally:
+			with self.lock:
+				del self.calls[key]
+			call['done'].set()
+
+ga_limiters = {}
+ga_limiters_lock = threading.Lock()
+ga_flights = SingleFlight()
+
+# One limiter per view, since GA counts each view's quota separately; requests that name no view share the None one.
+def get_ga_limiter(view):
+	with ga_limiters_lock:
+		if view not in ga_limiters:
+			ga_limiters[view] = RateLimiter(GA_QPS, GA_BURST, GA_DAILY_QUOTA)
+		return ga_limiters[view]
+
+# The view a request counts against: the viewId of a Reporting v4 body or the ids=ga:<view> of a v3 query. A batchGet may
+# only ask for one view, so its first report request names it. The management API names none.
+def get_request_view(request):
+	body = getattr(request, 'body', None)
+	if body:
+		try:
+			report_requests = json.loads(body).get('reportRequests') or [{}]
+			if report_requests[0].get('viewId'):
+				return str(report_requests[0]['viewId'])
+		except (ValueError, TypeError, AttributeError):
+			pass
+	ids = urllib.parse.parse_qs(urllib.parse.urlsplit(getattr(request, 'uri', None) or '').query).get('ids')
+	if ids:
+		return ids[0].split(':', 1)[-1]
+	return None
+
+# Rate limited by GA (429 or 403 rateLimitExceeded) or a transient backend error (500, 503): worth retrying after a wait.
+def is_retryable(error):
+	status = getattr(getattr(error, 'resp', None), 'status', None)
+	if status in (429, 500, 503):
+		return True
+	content = getattr(error, 'content', b'') or b''
+	return status == 403 and (b'rateLimitExceeded' in content or b'userRateLimitExceeded' in content)
+
+def execute_with_backoff(request, report):
+	limiter = get_ga_limiter(get_request_view(request))
+	for attempt in range(GA_RETRIES + 1):
+		limiter.acquire()
+		metrics.inc('ga_requests_total', report=report)
+		try:
+			with metrics.timer('ga_request_seconds', report=report):
+				return request.execute()
+		except Exception as e:
+			metrics.inc('ga_errors_total', report=report)
+			if attempt == GA_RETRIES or not is_retryable(e):
+				raise
+			metrics.inc('ga_retries_total', report=report)
+			time.sleep(GA_BACKOFF * 2**attempt + random.uniform(0, GA_BACKOFF))
+
+# Every GA request goes through here: identical requests in flight are coalesced into one, which then waits for the rate
+# limiter and is retried with exponential backoff while GA reports it is rate limited or unavailable.
+def execute_ga(request, report):
+	uri = getattr(request, 'uri', None)
+	if uri is None:
+		return execute_with_backoff(request, report)
+	value, leader = ga_flights.do((getattr(request, 'method', None), uri, getattr(request, 'body', None)), lambda: execute_with_backoff(request, report))
+	if not leader:
+		metrics.inc('ga_coalesced_total', report=report)
+	return value
 
 def get_first_profile_id(service):
-	accounts = service.management().accounts().list().execute()
+	accounts = execute_ga(service.management().accounts().list(), 'management')
 	if accounts.get('items'):
 		account = accounts.get('items')[0].get('id')
-		properties = service.management().webproperties().list(
-				accountId=account).execute()
+		properties = execute_ga(service.management().webproperties().list(
+				accountId=account), 'management')
 		if properties.get('items'):
 			property = properties.get('items')[0].get('id')
-			profiles = service.management().profiles().list(accountId=account,webPropertyId=property).execute()
+			profiles = execute_ga(service.management().profiles().list(accountId=account,webPropertyId=property), 'management')
 			if profiles.get('items'):
 				return profiles.get('items')[0].get('id')
 	return None
 
 def get_results(service, profile_id):
-	return service.data().realtime().get(
+	return execute_ga(service.data().realtime().get(
 				ids='ga:' + profile_id,
 				metrics='rt:activeUsers',
 				dimensions= 'rt:country, rt:region, rt:city, rt:longitude, rt:latitude, rt:medium, rt:source'
-			).execute()
+			), 'realtime')
 
-def get_plot(df, col):
-	plots = subplots.make_subplots(
-		rows=1, cols=1,
-		specs=[[{'type':'scattergeo'}]]
-	)
-	plots.add_trace(go.Scattergeo(
-		lon = df['longitude'],
-		lat = df['latitude'],
-		text = df['text'],
-		mode = 'markers',
-		marker = dict(size = (np.array(df['users'].astype(int))*10).tolist(), color = df[col].astype(float)/sum(df[col].astype(float))*100)
-	))
-	plots.update_layout(
-		geo = dict(
-			showland = True,
-			landcolor = "#60d952",
-			showocean = True,
-			oceancolor = "#80D0FF",
-			subunitcolor = "orange",
-			countrycolor = "black",
-			showlakes = False,
-			lakecolor = "lightblue",
-			showrivers = False,
-			rivercolor = "lightblue",
-			showsubunits = True,
-			showcountries = True,
-			resolution = 50,
-			projection = dict(type = "natural earth", scale = 1, rotation = dict(lon = 79, lat = 21))
-		),
-		title = 'Location Vs Info',
-		width = 1000,
-		height = 550,
-		margin = {'l':5,'r':5,'b':5,'t':40},
-		template = 'plotly_dark',
-		font = dict(family='Comic Sans MS', size=13)
+def get_realtime_rows(profile_id):
+	return get_results(get_realtime_service(), profile_id).get('rows', [])
+
+REALTIME_POLL_INTERVAL = float(os.environ.get('REALTIME_POLL_INTERVAL', '100'))
+REALTIME_MIN_REFRESH = float(os.environ.get('REALTIME_MIN_REFRESH', '10'))
+REALTIME_IDLE_AFTER = float(os.environ.get('REALTIME_IDLE_AFTER', '600'))
+REALTIME_HISTORY_SIZE = int(os.environ.get('REALTIME_HISTORY_SIZE', '720'))
+REALTIME_WINDOWS = [int(i) for i in os.environ.get('REALTIME_WINDOWS', '5,15,60').split(',')]
+REALTIME_DIMENSIONS = ['country', 'city', 'source', 'medium']
+
+# Active users of the snapshots polled in the last `seconds`, summed per view and dimension value as snapshots come in and
+# go out of the window. The peak of each view's total is kept with a deque of decreasing totals, so it is never rescanned.
+class RollingWindow:
+	def __init__(self, seconds, limit):
+		self.seconds = seconds
+		self.limit = limit
+		self.snapshots = deque()
+		self.sums = {}
+		self.peaks = {}
+
+	def add(self, snapshot):
+		self.snapshots.append(snapshot)
+		for key, users in snapshot['counts'].items():
+			self.sums[key] = self.sums.get(key, 0) + users
+		for view, total in snapshot['totals'].items():
+			peak = self.peaks.setdefault(view, deque())
+			while peak and peak[-1][1] <= total:
+				peak.pop()
+			peak.append((snapshot['time'], total))
+
+	def expire(self, now):
+		cutoff = now - self.seconds
+		while self.snapshots and (self.snapshots[0]['time'] <= cutoff or len(self.snapshots) > self.limit):
+			snapshot = self.snapshots.popleft()
+			for key, users in snapshot['counts'].items():
+				self.sums[key] -= users
+				if self.sums[key] == 0:
+					del self.sums[key]
+		first = self.snapshots[0]['time'] if self.snapshots else now
+		for view in list(self.peaks):
+			peak = self.peaks[view]
+			while peak and peak[0][0] < first:
+				peak.popleft()
+			if not peak:
+				del self.peaks[view]
+
+	def summary(self, view):
+		count = len(self.snapshots)
+		result = {'snapshots': count, 'peak': None}
+		if view in self.peaks:
+			result['peak'] = {'users': self.peaks[view][0][1], 'time': self.peaks[view][0][0]}
+		for dimension in REALTIME_DIMENSIONS:
+			values = [(key[2], users/count) for key, users in self.sums.items() if key[0] == view and key[1] == dimension]
+			result[dimension] = sorted(values, key=lambda i: -i[1])
+		return result
+
+# Ring buffer of the last REALTIME_HISTORY_SIZE real-time snapshots, fed by the poller, with a RollingWindow per entry of
+# REALTIME_WINDOWS (minutes). Every view is also counted under ALL_VIEWS, so the merged view needs no work when asked for.
+# Trends cost no GA requests, but there are gaps while the poller idles without viewers.
+class RealtimeHistory:
+	def __init__(self, size, windows):
+		self.snapshots = deque(maxlen=size)
+		self.windows = OrderedDict((minutes, RollingWindow(minutes*60, size)) for minutes in sorted(windows))
+		self.lock = threading.Lock()
+
+	def add(self, fetched_at, rows):
+		columns = [(dimension, column_names_real_time_geo.index(dimension)) for dimension in REALTIME_DIMENSIONS]
+		users_index = column_names_real_time_geo.index('users')
+		counts = {}
+		totals = {ALL_VIEWS: 0}
+		for view, view_rows in rows.items():
+			totals[view] = 0
+			for row in view_rows:
+				users = int(row[users_index])
+				for key in (view, ALL_VIEWS):
+					totals[key] += users
+					for dimension, index in columns:
+						counts[(key, dimension, row[index])] = counts.get((key, dimension, row[index]), 0) + users
+		snapshot = {'time': fetched_at, 'counts': counts, 'totals': totals}
+		with self.lock:
+			self.snapshots.append(snapshot)
+			for window in self.windows.values():
+				window.add(snapshot)
+				window.expire(fetched_at)
+
+	# A configured view that was not polled under its own id is the only one polled (the first profile the credentials
+	# see, when VIEW_IDS is not set), so the merged numbers are its own. Any other view has none.
+	def get_key(self, view):
+		if view in VIEW_IDS and not any(view in i['totals'] for i in self.snapshots):
+			return ALL_VIEWS
+		return view
+
+	# Average active users per country, city, source and medium and the peak total over each window, for one view or all.
+	def summary(self, view = ALL_VIEWS, now = None):
+		now = now or time.time()
+		with self.lock:
+			view = self.get_key(view)
+			result = OrderedDict()
+			for minutes, window in self.windows.items():
+				window.expire(now)
+				result[minutes] = window.summary(view)
+			return result
+
+	# Total active users of every buffered snapshot that has the view, oldest first.
+	def series(self, view = ALL_VIEWS):
+		with self.lock:
+			view = self.get_key(view)
+			return [(i['time'], i['totals'][view]) for i in self.snapshots if view in i['totals']]
+
+realtime_history = RealtimeHistory(REALTIME_HISTORY_SIZE, REALTIME_WINDOWS)
+
+# One poller per process serves the latest rt:activeUsers snapshot to every viewer. The views polled are VIEW_IDS when
+# that is configured and otherwise the first profile the credentials can see, resolved once; with several views they are
+# polled concurrently. Polling pauses when nobody has asked for a snapshot for REALTIME_IDLE_AFTER seconds.
+class RealtimePoller:
+	def __init__(self, interval):
+		self.interval = interval
+		self.profile_ids = None
+		self.rows = None
+		self.fetched_at = 0
+		self.last_access = 0
+		self.lock = threading.Lock()
+		self.poll_lock = threading.Lock()
+		self.stopped = threading.Event()
+		self.thread = None
+
+	# A lookup that found no profile is not remembered, so the next poll tries again.
+	def get_profile_ids(self, service):
+		if self.profile_ids is None:
+			if 'VIEW_IDS' in os.environ:
+				self.profile_ids = VIEW_IDS
+			else:
+				profile_id = get_first_profile_id(service)
+				if profile_id is None:
+					raise LookupError('No Google Analytics profile is visible to the credentials')
+				self.profile_ids = [profile_id]
+		return self.profile_ids
+
+	def fetch(self):
+		profile_ids = self.get_profile_ids(get_realtime_service())
+		results = async_access.gather(*[async_access.ga(get_realtime_rows, i) for i in profile_ids])
+		with self.lock:
+			self.rows = dict(zip(profile_ids, results))
+			self.fetched_at = time.time()
+		realtime_history.add(self.fetched_at, self.rows)
+
+	def poll(self):
+		with self.poll_lock:
+			self.fetch()
+
+	def run(self):
+		while not self.stopped.wait(self.interval):
+			if time.time() - self.last_access > REALTIME_IDLE_AFTER:
+				continue
+			try:
+				self.poll()
+			except Exception:
+				logger.exception('Real-time poll failed')
+
+	def start(self):
+		with self.lock:
+			if self.thread is None:
+				self.thread = threading.Thread(target=self.run, name='realtime', daemon=True)
+				self.thread.start()
+
+	def latest(self, max_age = None, view = ALL_VIEWS):
+		return self.snapshot(max_age, view)[1]
+
+	# Rows of one view, or of every polled view when `view` is ALL_VIEWS or was not polled on its own.
+	def snapshot(self, max_age = None, view = ALL_VIEWS):
+		self.start()
+		self.last_access = time.time()
+		if max_age is None:
+			max_age = self.interval
+		if self.rows is None or time.time() - self.fetched_at > max_age:
+			fetched_at = self.fetched_at
+			with self.poll_lock:
+				# Callers that queued behind another refresh reuse its result.
+				if self.fetched_at == fetched_at:
+					self.fetch()
+		with self.lock:
+			if view in self.rows:
+				return self.fetched_at, [list(row) for row in self.rows[view]]
+			return self.fetched_at, [list(row) for rows in self.rows.values() for row in rows]
+
+	def stop(self):
+		self.stopped.set()
+
+realtime_poller = RealtimePoller(REALTIME_POLL_INTERVAL)
+
+metric_types = {'INTEGER': 'int64', 'FLOAT': 'float64', 'CURRENCY': 'float64', 'PERCENT': 'float64', 'TIME': 'float64'}
+dimension_types = {'ga:longitude': 'float64', 'ga:latitude': 'float64'}
+
+# Decodes the columnHeader once and converts every dimension and metric column in one vectorised step, typed from the
+# metric types GA reports. `columns` renames the columns positionally; names beyond the report's own are added empty.
+def parse_report(report, columns = None):
+	columnHeader = report.get('columnHeader', {})
+	dimensionHeaders = columnHeader.get('dimensions', [])
+	metricHeaders = columnHeader.get('metricHeader', {}).get('metricHeaderEntries', [])
+	rows = report.get('data', {}).get('rows', [])
+	data = OrderedDict()
+	if len(dimensionHeaders) > 0:
+		dimensions = np.array([row['dimensions'] for row in rows], dtype=str).reshape(len(rows), len(dimensionHeaders))
+		for i, header in enumerate(dimensionHeaders):
+			data[header] = dimensions[:, i].astype(dimension_types.get(header, object))
+	if len(metricHeaders) > 0:
+		values = np.array([row['metrics'][0]['values'] for row in rows], dtype=str).reshape(len(rows), len(metricHeaders))
+		for i, header in enumerate(metricHeaders):
+			data[header.get('name')] = values[:, i].astype(metric_types.get(header.get('type'), np.float64))
+	frame = pd.DataFrame(data)
+	if columns is not None:
+		frame.columns = columns[:len(frame.columns)]
+		for column in columns[len(frame.columns):]:
+			frame[column] = ''
+	return frame
+
+def parse_response(response, columns = None):
+	frames = [parse_report(report, columns) for report in response.get('reports', [])]
+	if len(frames) == 1:
+		return frames[0]
+	return pd.concat(frames, ignore_index=True)
+
+GEO_PAGE_SIZE = int(os.environ.get('GEO_PAGE_SIZE', '10000'))
+GEO_MARKER_BUDGET = int(os.environ.get('GEO_MARKER_BUDGET', '500'))
+GEO_GRID_START = float(os.environ.get('GEO_GRID_START', '0.25'))
+GEO_MAX_MARKER_SIZE = float(os.environ.get('GEO_MAX_MARKER_SIZE', '60'))
+
+# Follows nextPageToken and yields each page as a typed chunk, so only one raw page is held in memory at a time.
+def iter_report(report_request, columns = None, page_size = GEO_PAGE_SIZE, name = 'report'):
+	analytics = get_analytics()
+	page_token = None
+	while True:
+		request = dict(report_request, pageSize=page_size)
+		if page_token is not None:
+			request['pageToken'] = page_token
+		response = execute_ga(analytics.reports().batchGet(body={'reportRequests': [request]}), name)
+		report = response.get('reports', [{}])[0]
+		yield parse_report(report, columns)
+		page_token = report.get('nextPageToken')
+		if page_token is None:
+			break
+
+def read_report(report_request, columns = None, page_size = GEO_PAGE_SIZE, name = 'report'):
+	return pd.concat(list(iter_report(report_request, columns, page_size, name)), ignore_index=True)
+
+def get_markers(df, col):
+	markers = dict(
+		lon = df['longitude'].tolist(),
+		lat = df['latitude'].tolist(),
+		text = df['text'].tolist(),
+		marker = dict(size = (np.array(df['users'].astype(int))*10).tolist(), color = (df[col].astype(float)/sum(df[col].astype(float))*100).tolist())
 	)
-	plots.update_yaxes(automargin=True)
-	return plots
+	if 'cell' in df:
+		# Clusters can hold thousands of users, so their size grows with the square root and is capped.
+		markers['marker']['size'] = np.clip(np.sqrt(df['users'].astype(float))*10, 10, GEO_MAX_MARKER_SIZE).tolist()
+		markers['customdata'] = df['cell'].tolist()
+	return markers
+
+# Bins the points onto a grid of `size` degree cells, doubling the cell size until at most `budget` cells are occupied.
+# Additive metrics are summed per cell, rates are averaged weighted by sessions, and each marker sits at the users-weighted
+# centre of its cell. Markers that stand for several places carry their cell as [lon, lat, size] for drilling down.
+def aggregate_geo(dataf, budget = None, size = None):
+	budget = budget or GEO_MARKER_BUDGET
+	size = size or GEO_GRID_START
+	if len(dataf) <= budget:
+		return dataf
+	lon = dataf['longitude'].to_numpy(dtype=float)
+	lat = dataf['latitude'].to_numpy(dtype=float)
+	while True:
+		cells = get_geo_cells(lon, lat, size)
+		if len(np.unique(cells)) <= budget:
+			break
+		size *= 2
+	weight = dataf['users'].to_numpy(dtype=float)
+	frame = dataf.assign(cell_id = cells, weight = weight, wlon = lon*weight, wlat = lat*weight, places = 1)
+	sums = [i for i in ('users', 'sessions', 'UniquePageviews', 'hits') if i in dataf]
+	grouped = frame.groupby('cell_id', sort=False)
+	result = grouped[sums + ['weight', 'wlon', 'wlat', 'places']].sum()
+	top = frame.loc[grouped['weight'].idxmax().to_numpy()].set_index('cell_id').loc[result.index]
+	for column in dataf.columns:
+		if column not in result:
+			result[column] = top[column]
+	mean_lon = grouped['longitude'].mean()
+	mean_lat = grouped['latitude'].mean()
+	result['longitude'] = np.where(result['weight'] > 0, result['wlon']/result['weight'].where(result['weight'] > 0, 1), mean_lon)
+	result['latitude'] = np.where(result['weight'] > 0, result['wlat']/result['weight'].where(result['weight'] > 0, 1), mean_lat)
+	for column in ('bounceRate', 'avgSessionDuration'):
+		if column in dataf:
+			weighted = (frame[column]*frame['sessions']).groupby(frame['cell_id']).sum()
+			result[column] = (weighted/result['sessions'].where(result['sessions'] > 0)).fillna(0).round(2)
+	text = result['places'].astype(str)+' places around '+top['city']+','+top['region']+','+top['country']+'<br>'+'Users : '+result['users'].astype(str)
+	if 'sessions' in result:
+		text = text+'<br>'+'Sessions : '+result['sessions'].astype(str)
+	for column, label in (('source', 'Top Source'), ('medium', 'Top Medium')):
+		if column in result:
+			text = text+'<br>'+label+' : '+top[column]
+	result['text'] = np.where(result['places'] > 1, text, top['text'])
+	cell_x = result.index.to_numpy() // 100000
+	cell_y = result.index.to_numpy() % 100000
+	result['cell'] = [[float(x*size - 180), float(y*size - 90), float(size)] if places > 1 else None for x, y, places in zip(cell_x, cell_y, result['places'])]
+	return result.reset_index(drop=True)[list(dataf.columns) + ['cell']]
+
+def get_geo_cells(lon, lat, size):
+	return np.floor((lon + 180)/size).astype(np.int64)*100000 + np.floor((lat + 90)/size).astype(np.int64)
+
+# All places inside the cell a cluster marker was built from, unaggregated.
+def select_geo_cell(dataf, cell):
+	lon, lat, size = cell
+	cells = get_geo_cells(dataf['longitude'].to_numpy(dtype=float), dataf['latitude'].to_numpy(dtype=float), size)
+	return dataf[cells == get_geo_cells(np.array([lon + size/2]), np.array([lat + size/2]), size)[0]]
+
+def decimate_geo(dataf, cell = None):
+	if cell is None:
+		return aggregate_geo(dataf)
+	return select_geo_cell(dataf, cell)
+
+# Figures are assembled as plain dicts so plotly never validates them; Dash only has to JSON-encode lists.
+@functools.lru_cache()
+def get_template(name):
+	return pio.templates[name].to_plotly_json()
+
+def get_plot(df, col):
+	return {
+		'data': [dict(type = 'scattergeo', mode = 'markers', geo = 'geo', **get_markers(df, col))],
+		'layout': dict(
+			geo = dict(
+				domain = dict(x = [0.0, 1.0], y = [0.0, 1.0]),
+				showland = True,
+				landcolor = "#60d952",
+				showocean = True,
+				oceancolor = "#80D0FF",
+				subunitcolor = "orange",
+				countrycolor = "black",
+				showlakes = False,
+				lakecolor = "lightblue",
+				showrivers = False,
+				rivercolor = "lightblue",
+				showsubunits = True,
+				showcountries = True,
+				resolution = 50,
+				projection = dict(type = "natural earth", scale = 1, rotation = dict(lon = 79, lat = 21))
+			),
+			title = dict(text = 'Location Vs Info'),
+			width = 1000,
+			height = 550,
+			margin = {'l':5,'r':5,'b':5,'t':40},
+			template = get_template('plotly_dark'),
+			font = dict(family='Comic Sans MS', size=13)
+		)
+	}
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '10'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+DB_POOL_CHECK_INTERVAL = float(os.environ.get('DB_POOL_CHECK_INTERVAL', '30'))
+
+class PoolTimeout(Exception):
+	pass
+
+# Bounded pool of Postgres connections shared by every data-access path. A checkout waits up to `timeout` seconds for a free slot,
+# and a connection that sat idle longer than `check_interval` is pinged before it is handed out.
+class ConnectionPool:
+	def __init__(self, connect, size, timeout, check_interval):
+		self.connect = connect
+		self.size = size
+		self.timeout = timeout
+		self.check_interval = check_interval
+		self.idle = deque()
+		self.in_use = 0
+		self.slots = threading.BoundedSemaphore(size)
+		self.lock = threading.Lock()
+
+	def getconn(self):
+		start = time.time()
+		acquired = self.slots.acquire(timeout=self.timeout)
+		metrics.observe('db_pool_wait_seconds', time.time() - start)
+		if not acquired:
+			metrics.inc('db_pool_timeouts_total')
+			raise PoolTimeout('No database connection available after {0}s ({1} in use)'.format(self.timeout, self.size))
+		try:
+			conn = self.checkout()
+		except Exception:
+			self.slots.release()
+			raise
+		with self.lock:
+			self.in_use += 1
+		return conn
+
+	def checkout(self):
+		while True:
+			with self.lock:
+				if len(self.idle) == 0:
+					break
+				conn, returned_at = self.idle.pop()
+			if self.is_healthy(conn, returned_at):
+				return conn
+			self.discard(conn)
+		return self.connect()
+
+	def is_healthy(self, conn, returned_at):
+		if conn.closed:
+			return False
+		if time.time() - returned_at < self.check_interval:
+			return True
+		try:
+			cur = conn.cursor()
+			cur.execute("select 1")
+			cur.close()
+			conn.rollback()
+			return True
+		except Exception:
+			return False
+
+	def discard(self, conn):
+		try:
+			conn.close()
+		except Exception:
+			pass
+
+	def putconn(self, conn, broken = False):
+		if not broken and not conn.closed:
+			try:
+				conn.rollback()
+			except Exception:
+				broken = True
+		with self.lock:
+			self.in_use -= 1
+			if not broken and not conn.closed:
+				self.idle.append((conn, time.time()))
+		if broken or conn.closed:
+			self.discard(conn)
+		self.slots.release()
+
+	@contextmanager
+	def connection(self):
+		conn = self.getconn()
+		try:
+			yield conn
+		except Exception:
+			self.putconn(conn, broken = conn.closed)
+			raise
+		self.putconn(conn)
+
+	def status(self):
+		with self.lock:
+			return {'size': self.size, 'in_use': self.in_use, 'idle': len(self.idle)}
+
+	# Connections inherited from a parent process share its sockets; forget them without closing so the parent's keep working.
+	def reset_after_fork(self):
+		self.lock = threading.Lock()
+		self.idle = deque()
+		self.in_use = 0
+		self.slots = threading.BoundedSemaphore(self.size)
+
+	def closeall(self):
+		with self.lock:
+			idle, self.idle = self.idle, deque()
+		for conn, returned_at in idle:
+			self.discard(conn)
+
+# Times every statement run on a pooled connection, labelled by its leading keyword (select, insert, create, ...). The class
+# derives from psycopg2's cursor, so it is defined on the first connection rather than at import.
+@functools.lru_cache()
+def get_timed_cursor():
+	class TimedCursor(psycopg2.extensions.cursor):
+		def execute(self, query, vars = None):
+			with metrics.timer('db_query_seconds', statement=query.split(None, 1)[0].lower()):
+				return psycopg2.extensions.cursor.execute(self, query, vars)
+
+		def copy_expert(self, sql, file, size = 8192):
+			with metrics.timer('db_query_seconds', statement='copy'):
+				return psycopg2.extensions.cursor.copy_expert(self, sql, file, size)
+	return TimedCursor
+
+db_pool = ConnectionPool(lambda: psycopg2.connect(DATABASE_URL, cursor_factory=get_timed_cursor()), DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_CHECK_INTERVAL)
+
+ACCESS_GA_CONCURRENCY = int(os.environ.get('ACCESS_GA_CONCURRENCY', '8'))
+ACCESS_DB_CONCURRENCY = int(os.environ.get('ACCESS_DB_CONCURRENCY', str(DB_POOL_SIZE)))
+ACCESS_GA_TIMEOUT = float(os.environ.get('ACCESS_GA_TIMEOUT', '30'))
+ACCESS_DB_TIMEOUT = float(os.environ.get('ACCESS_DB_TIMEOUT', '15'))
+
+class CallTimeout(Exception):
+	pass
+
+# Data access for the callbacks. One event loop in a background thread admits GA and database calls through a semaphore
+# per kind and runs them on a thread pool sized to match, so a callback can await several reports at once and callers over
+# the limit queue on the loop instead of each holding a thread. A call's deadline covers its wait for a slot; past it the
+# caller gets CallTimeout, while the slot stays taken until the blocking client returns. The functions run here build their
+# own GA services (they are per thread) and must not call back into the loop.
+class AsyncAccess:
+	def __init__(self, ga_concurrency, db_concurrency):
+		self.concurrency = {'ga': ga_concurrency, 'db': db_concurrency}
+		self.loop = None
+		self.executor = None
+		self.slots = None
+		self.active = {'ga': 0, 'db': 0}
+		self.lock = threading.Lock()
+
+	def start(self):
+		with self.lock:
+			if self.loop is None:
+				loop = asyncio.new_event_loop()
+				ready = threading.Event()
+				self.executor = ThreadPoolExecutor(max_workers=sum(self.concurrency.values()), thread_name_prefix='access')
+				threading.Thread(target=self.run, args=(loop, ready), name='access', daemon=True).start()
+				ready.wait()
+				self.loop = loop
+			return self.loop
+
+	def run(self, loop, ready):
+		asyncio.set_event_loop(loop)
+		self.slots = dict((kind, asyncio.Semaphore(value)) for kind, value in self.concurrency.items())
+		loop.call_soon(ready.set)
+		loop.run_forever()
+
+	async def call(self, kind, timeout, function, *args):
+		loop = asyncio.get_event_loop()
+		start = loop.time()
+		try:
+			await asyncio.wait_for(self.slots[kind].acquire(), timeout)
+		except asyncio.TimeoutError:
+			raise self.timeout(kind, function, timeout)
+		metrics.observe('access_wait_seconds', loop.time() - start, kind=kind)
+		self.active[kind] += 1
+		future = loop.run_in_executor(self.executor, functools.partial(function, *args))
+		future.add_done_callback(lambda future: self.release(kind, future))
+		try:
+			return await asyncio.wait_for(asyncio.shield(future), max(0, start + timeout - loop.time()))
+		except asyncio.TimeoutError:
+			# A timeout raised by the call itself, e.g. a socket timeout, is passed on as it is.
+			if future.done():
+				raise
+			raise self.timeout(kind, function, timeout)
+
+	def release(self, kind, future):
+		self.active[kind] -= 1
+		self.slots[kind].release()
+		if not future.cancelled():
+			future.exception()
+
+	def timeout(self, kind, function, timeout):
+		metrics.inc('access_timeouts_total', kind=kind)
+		return CallTimeout('{0} call {1} did not finish within {2}s'.format(kind, getattr(function, '__name__', function), timeout))
+
+	async def ga(self, function, *args):
+		return await self.call('ga', ACCESS_GA_TIMEOUT, function, *args)
+
+	async def db(self, function, *args):
+		return await self.call('db', ACCESS_DB_TIMEOUT, function, *args)
+
+	# Runs the coroutines on the loop at the same time and blocks the calling thread until all of them are done. With
+	# return_exceptions a failed call comes back as its exception instead of failing the rest.
+	def gather(self, *coroutines, return_exceptions = False):
+		async def gather():
+			return await asyncio.gather(*coroutines, return_exceptions=return_exceptions)
+		return asyncio.run_coroutine_threadsafe(gather(), self.start()).result()
+
+	def run_call(self, kind, function, *args):
+		return self.gather(getattr(self, kind)(function, *args))[0]
+
+	def status(self):
+		return dict(self.active)
+
+	# The loop thread does not survive a fork; the child starts its own on first use.
+	def reset_after_fork(self):
+		self.lock = threading.Lock()
+		self.loop = None
+		self.executor = None
+		self.slots = None
+		self.active = {'ga': 0, 'db': 0}
+
+async_access = AsyncAccess(ACCESS_GA_CONCURRENCY, ACCESS_DB_CONCURRENCY)
+
+# Callback side of map_views: `function(*args, view)` for every selected view, as one `kind` call each, awaited together.
+async def gather_views(kind, function, view, *args):
+	call = getattr(async_access, kind)
+	return await asyncio.gather(*[call(function, *(args + (i,))) for i in get_views(view)])
+
+REPORT_TTL = float(os.environ.get('REPORT_TTL', '600'))
+REPORT_CACHE_MAX_BYTES = int(os.environ.get('REPORT_CACHE_MAX_BYTES', str(64*1024*1024)))
+FIGURE_CACHE_MAX_BYTES = int(os.environ.get('FIGURE_CACHE_MAX_BYTES', str(32*1024*1024)))
+
+# Raised by a compute function whose result is usable but should not be cached, e.g. a figure with a failed panel.
+class PartialResult(Exception):
+	def __init__(self, value):
+		Exception.__init__(self)
+		self.value = value
+
+SHARED_CACHE = os.environ.get('SHARED_CACHE', 'disk')
+SHARED_CACHE_DIR = os.environ.get('SHARED_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'traffic-analysis-cache-{0}'.format(os.getuid())))
+SHARED_CACHE_SECRET = os.environ.get('SHARED_CACHE_SECRET')
+SHARED_CACHE_URL = os.environ.get('SHARED_CACHE_URL', 'redis://localhost:6379/0')
+SHARED_CACHE_PREFIX = os.environ.get('SHARED_CACHE_PREFIX', 'traffic')
+SHARED_CACHE_MAX_BYTES = int(os.environ.get('SHARED_CACHE_MAX_BYTES', str(256*1024*1024)))
+SHARED_CACHE_CHECK_INTERVAL = float(os.environ.get('SHARED_CACHE_CHECK_INTERVAL', '1'))
+SHARED_CACHE_LEASE = float(os.environ.get('SHARED_CACHE_LEASE', '60'))
+
+# Shared cache backends store bytes under string keys for `ttl` seconds and implement get, set, add (set only if absent,
+# returning whether it did) and delete. Their `secret` signs the entries, which are unpickled when loaded, so a backend
+# only works with a secret that nobody who can write to it without running the app can read.
+
+# The directory of the disk backend: created for this user only, and refused unless it is a directory this user owns
+# that nobody else can open, since whoever can write a file into it can run code in the app.
+def get_private_directory(path):
+	os.makedirs(path, mode=0o700, exist_ok=True)
+	info = os.lstat(path)
+	if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+		raise PermissionError('{0} must be a directory owned by uid {1} and closed to everyone else'.format(path, os.getuid()))
+	return path
+
+# One file per key, replaced atomically, in a private directory every worker on the host can see. Pointing SHARED_CACHE_DIR
+# at a subdirectory of /dev/shm, such as /dev/shm/traffic-cache, keeps it in memory; /dev/shm itself is shared by every
+# user and so is refused. Without SHARED_CACHE_SECRET the secret is a random key kept in the directory. Once the directory
+# grows past `max_bytes`, expired files are removed and then the oldest.
+# Keys ending in one of `pinned` (a SharedCache's generation and refresh leases) are only ever removed once expired:
+# evicting a generation would flush the whole cache in every worker and leave its entries behind.
+class DiskCacheBackend:
+	pinned = (':generation', ':refresh')
+
+	def __init__(self, directory, max_bytes, secret = None):
+		self.directory = get_private_directory(directory)
+		self.max_bytes = max_bytes
+		self.written = 0
+		self.lock = threading.Lock()
+		self.secret = secret or self.get_secret()
+
+	# The first worker to get here links its key into place; the others read that one.
+	def get_secret(self):
+		path = os.path.join(self.directory, '.secret')
+		if not os.path.exists(path):
+			tmp = '{0}.{1}.{2}.tmp'.format(path, os.getpid(), threading.get_ident())
+			with os.fdopen(os.open(tmp, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600), 'wb') as f:
+				f.write(os.urandom(32))
+			try:
+				os.link(tmp, path)
+			except FileExistsError:
+				pass
+			finally:
+				os.remove(tmp)
+		with open(path, 'rb') as f:
+			return f.read()
+
+	def path(self, key):
+		name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+		if key.endswith(self.pinned):
+			name += '.pin'
+		return os.path.join(self.directory, name)
+
+	def get(self, key):
+		try:
+			with open(self.path(key), 'rb') as f:
+				data = f.read()
+		except (IOError, OSError):
+			return None
+		# A lease file another worker has created but not written yet.
+		if len(data) < 8:
+			return b''
+		if time.time() >= struct.unpack('!d', data[:8])[0]:
+			return None
+		return data[8:]
+
+	def set(self, key, data, ttl):
+		path = self.path(key)
+		tmp = '{0}.{1}.{2}.tmp'.format(path, os.getpid(), threading.get_ident())
+		with open(tmp, 'wb') as f:
+			f.write(struct.pack('!d', time.time() + ttl) + data)
+		os.replace(tmp, path)
+		with self.lock:
+			self.written += len(data)
+			prune = self.written > self.max_bytes/10
+			if prune:
+				self.written = 0
+		if prune:
+			self.prune()
+
+	def add(self, key, data, ttl):
+		for attempt in range(2):
+			try:
+				fd = os.open(self.path(key), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+			except FileExistsError:
+				if self.get(key) is not None:
+					return False
+				self.delete(key)
+				continue
+			with os.fdopen(fd, 'wb') as f:
+				f.write(struct.pack('!d', time.time() + ttl) + data)
+			return True
+		return False
+
+	def delete(self, key):
+		try:
+			os.remove(self.path(key))
+		except OSError:
+			pass
+
+	def prune(self):
+		now = time.time()
+		files = []
+		for name in os.listdir(self.directory):
+			# The secret and its temporary files are not entries.
+			if name.startswith('.'):
+				continue
+			path = os.path.join(self.directory, name)
+			try:
+				info = os.stat(path)
+				with open(path, 'rb') as f:
+					header = f.read(8)
+				if len(header) == 8 and now >= struct.unpack('!d', header)[0]:
+					os.remove(path)
+					continue
+			except OSError:
+				continue
+			files.append((info.st_mtime, info.st_size, name))
+		total = sum(i[1] for i in files)
+		for mtime, size, name in sorted(files):
+			if total <= self.max_bytes:
+				break
+			if name.endswith('.pin'):
+				continue
+			try:
+				os.remove(os.path.join(self.directory, name))
+				total -= size
+			except OSError:
+				pass
+
+# Shared by every host using the same Redis, so they need the same SHARED_CACHE_SECRET. The redis package is only needed
+# when this backend is configured.
+class RedisCacheBackend:
+	def __init__(self, url, secret):
+		if not secret:
+			raise ValueError('SHARED_CACHE_SECRET must be set to share the cache through Redis')
+		import redis
+		self.client = redis.Redis.from_url(url)
+		self.secret = secret
+
+	def get(self, key):
+		return self.client.get(key)
+
+	def set(self, key, data, ttl):
+		self.client.set(key, data, px=max(1, int(ttl*1000)))
+
+	def add(self, key, data, ttl):
+		return bool(self.client.set(key, data, px=max(1, int(ttl*1000)), nx=True))
+
+	def delete(self, key):
+		self.client.delete(key)
+
+# The network backend's behaviour inside one process, for tests and bench.py.
+class MemoryCacheBackend:
+	def __init__(self):
+		self.entries = {}
+		self.lock = threading.Lock()
+		self.secret = os.urandom(32)
+
+	def get(self, key):
+		with self.lock:
+			entry = self.entries.get(key)
+		if entry is None or time.time() >= entry[0]:
+			return None
+		return entry[1]
+
+	def set(self, key, data, ttl):
+		with self.lock:
+			self.entries[key] = (time.time() + ttl, data)
+
+	def add(self, key, data, ttl):
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is not None and time.time() < entry[0]:
+				return False
+			self.entries[key] = (time.time() + ttl, data)
+			return True
+
+	def delete(self, key):
+		with self.lock:
+			self.entries.pop(key, None)
+
+# A backend that cannot be set up safely is left out, and every worker caches on its own.
+def get_shared_backend():
+	secret = None if SHARED_CACHE_SECRET is None else SHARED_CACHE_SECRET.encode('utf-8')
+	try:
+		if SHARED_CACHE == 'disk':
+			return DiskCacheBackend(SHARED_CACHE_DIR, SHARED_CACHE_MAX_BYTES, secret)
+		if SHARED_CACHE == 'redis':
+			return RedisCacheBackend(SHARED_CACHE_URL, secret)
+		if SHARED_CACHE == 'memory':
+			return MemoryCacheBackend()
+	except Exception:
+		logger.exception('Shared %s cache is disabled', SHARED_CACHE)
+	return None
+
+# The part of a TTLCache every worker sees. An entry is the pickled value with its expiry and version, and the version is
+# also stored on its own so a worker can cheaply tell whether another one has stored something newer. Keys carry a
+# generation, and invalidating the whole cache just replaces it. Entries outlive their TTL by as much again so a stale
+# value can be served while one worker, holding the refresh lease, recomputes it.
+class SharedCache:
+	def __init__(self, backend, name, check_interval):
+		self.backend = backend
+		self.name = name
+		self.check_interval = check_interval
+		self.generation = None
+		self.generation_checked = 0
+
+	def new_token(self):
+		return '{0:x}-{1}-{2:x}'.format(int(time.time()*1000000), os.getpid(), random.getrandbits(32))
+
+	def get_generation(self):
+		if self.generation is None or time.time() - self.generation_checked > self.check_interval:
+			key = '{0}:{1}:generation'.format(SHARED_CACHE_PREFIX, self.name)
+			generation = self.backend.get(key)
+			if not generation:
+				self.backend.add(key, self.new_token().encode('utf-8'), 365*86400)
+				generation = self.backend.get(key) or b''
+			self.generation = generation.decode('utf-8')
+			self.generation_checked = time.time()
+		return self.generation
+
+	def get_key(self, key):
+		return '{0}:{1}:{2}:{3!r}'.format(SHARED_CACHE_PREFIX, self.name, self.get_generation(), key)
+
+	def get_version(self, key):
+		version = self.backend.get(self.get_key(key) + ':version')
+		return None if version is None else version.decode('utf-8')
+
+	# HMAC of an entry under its key, so an entry is neither forged nor moved to another key.
+	def sign(self, shared_key, data):
+		return hmac.new(self.backend.secret, shared_key.encode('utf-8') + data, hashlib.sha256).digest()
+
+	def load(self, key):
+		shared_key = self.get_key(key)
+		data = self.backend.get(shared_key)
+		if not data:
+			return None
+		signature, data = data[:32], data[32:]
+		if not hmac.compare_digest(signature, self.sign(shared_key, data)):
+			raise ValueError('Shared cache entry {0} has an invalid signature'.format(shared_key))
+		expires_at, version, value = pickle.loads(data)
+		return pickle.loads(value), expires_at, len(value), version
+
+	def store(self, key, data, expires_at, version, ttl):
+		shared_key = self.get_key(key)
+		data = pickle.dumps((expires_at, version, data), pickle.HIGHEST_PROTOCOL)
+		self.backend.set(shared_key, self.sign(shared_key, data) + data, 2*ttl)
+		self.backend.set(shared_key + ':version', version.encode('utf-8'), 2*ttl)
+
+	def lease(self, key):
+		return self.backend.add(self.get_key(key) + ':refresh', b'1', SHARED_CACHE_LEASE)
+
+	def release(self, key):
+		self.backend.delete(self.get_key(key) + ':refresh')
+
+	def invalidate(self, key = None):
+		if key is None:
+			self.generation = self.new_token()
+			self.generation_checked = time.time()
+			self.backend.set('{0}:{1}:generation'.format(SHARED_CACHE_PREFIX, self.name), self.generation.encode('utf-8'), 365*86400)
+		else:
+			self.backend.delete(self.get_key(key))
+			self.backend.delete(self.get_key(key) + ':version')
+
+# Keyed result cache with a TTL per entry. An expired entry is still served while a single background thread recomputes it,
+# and the least recently used entries are evicted once the pickled size of everything cached goes over `max_bytes`.
+# With a SharedCache underneath, a value computed by one worker is loaded by the others instead of being computed again, and
+# a local entry is checked against the shared version at most every check_interval seconds. Versions are tokens stored with
+# the value, so figures derived from the same report version are keyed the same in every worker. If the backend fails,
+# the cache keeps working locally.
+class TTLCache:
+	def __init__(self, max_bytes, name = 'cache', shared = None):
+		self.max_bytes = max_bytes
+		self.name = name
+		self.shared = shared
+		self.entries = OrderedDict()
+		self.size = 0
+		self.refreshing = set()
+		self.lock = threading.Lock()
+
+	def get_or_compute(self, key, compute, ttl):
+		return self.get_versioned(key, compute, ttl)[0]
+
+	# Also returns the version of the value; every set() gets a new one, so it can key anything derived from the value.
+	def get_versioned(self, key, compute, ttl):
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is not None:
+				self.entries.move_to_end(key)
+		result = 'hit'
+		if self.shared is not None and (entry is None or time.time() - entry[4] > self.shared.check_interval):
+			entry, loaded = self.sync(key, entry)
+			if loaded:
+				result = 'shared'
+		if entry is not None:
+			value, expires_at, weight, version, checked_at = entry
+			if time.time() < expires_at:
+				metrics.inc('cache_requests_total', cache=self.name, key=key[0], result=result)
+				return value, version
+			metrics.inc('cache_requests_total', cache=self.name, key=key[0], result='stale')
+			self.start_refresh(key, compute, ttl)
+			return value, version
+		metrics.inc('cache_requests_total', cache=self.name, key=key[0], result='miss')
+		try:
+			value = compute()
+		except PartialResult as e:
+			return e.value, None
+		return value, self.set(key, value, ttl)
+
+	# The local entry while the shared version still matches it, otherwise whatever is shared now (None once it is gone,
+	# e.g. after another worker invalidated it). Also returns whether the entry was loaded from the backend.
+	def sync(self, key, entry):
+		try:
+			version = self.shared.get_version(key)
+			if entry is not None and version == entry[3]:
+				entry = entry[:4] + (time.time(),)
+				self.install(key, entry)
+				return entry, False
+			loaded = None if version is None else self.shared.load(key)
+		except Exception:
+			self.shared_failed('read')
+			return entry, False
+		if loaded is None:
+			self.discard(key)
+			return None, False
+		value, expires_at, weight, version = loaded
+		entry = (value, expires_at, weight, version, time.time())
+		self.install(key, entry)
+		return entry, True
+
+	def start_refresh(self, key, compute, ttl):
+		with self.lock:
+			if key in self.refreshing:
+				return
+			self.refreshing.add(key)
+		leased = True
+		if self.shared is not None:
+			try:
+				leased = self.shared.lease(key)
+			except Exception:
+				self.shared_failed('lease')
+		if not leased:
+			# Another worker is refreshing it; its value is picked up at the next check.
+			with self.lock:
+				self.refreshing.discard(key)
+			return
+		threading.Thread(target=self.refresh, args=(key, compute, ttl), daemon=True).start()
+
+	def refresh(self, key, compute, ttl):
+		try:
+			self.set(key, compute(), ttl)
+		except PartialResult:
+			pass
+		except Exception:
+			logger.exception('Background refresh of %s failed', key)
+		finally:
+			with self.lock:
+				self.refreshing.discard(key)
+			if self.shared is not None:
+				try:
+					self.shared.release(key)
+				except Exception:
+					self.shared_failed('lease')
+
+	def set(self, key, value, ttl):
+		data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+		expires_at = time.time() + ttl
+		# Random bits as well, since workers on other hosts can share a pid and a clock tick.
+		version = '{0:x}-{1}-{2:x}'.format(int(time.time()*1000000), os.getpid(), random.getrandbits(64))
+		checked_at = time.time()
+		if self.shared is not None:
+			try:
+				self.shared.store(key, data, expires_at, version, ttl)
+			except Exception:
+				self.shared_failed('write')
+				# Not shared, so there is nothing to check it against.
+				checked_at = float('inf')
+		self.install(key, (value, expires_at, len(data), version, checked_at))
+		return version
+
+	def install(self, key, entry):
+		with self.lock:
+			if key in self.entries:
+				self.size -= self.entries.pop(key)[2]
+			if entry[2] > self.max_bytes:
+				return
+			self.entries[key] = entry
+			self.size += entry[2]
+			while self.size > self.max_bytes:
+				evicted_key, evicted = self.entries.popitem(last=False)
+				self.size -= evicted[2]
+
+	def discard(self, key):
+		with self.lock:
+			if key in self.entries:
+				self.size -= self.entries.pop(key)[2]
+
+	def shared_failed(self, operation):
+		metrics.inc('shared_cache_errors_total', cache=self.name)
+		logger.warning('Shared %s cache %s failed', self.name, operation, exc_info=True)
+
+	def invalidate(self, key = None):
+		with self.lock:
+			if key is None:
+				self.entries.clear()
+				self.size = 0
+			elif key in self.entries:
+				self.size -= self.entries.pop(key)[2]
+		if self.shared is not None:
+			try:
+				self.shared.invalidate(key)
+			except Exception:
+				self.shared_failed('invalidate')
+
+shared_backend = get_shared_backend()
+
+def get_shared_cache(name):
+	if shared_backend is None:
+		return None
+	return SharedCache(shared_backend, name, SHARED_CACHE_CHECK_INTERVAL)
+
+report_cache = TTLCache(REPORT_CACHE_MAX_BYTES, 'report', get_shared_cache('report'))
+figure_cache = TTLCache(FIGURE_CACHE_MAX_BYTES, 'figure', get_shared_cache('figure'))
+
+def cached_report(ttl):
+	def decorator(func):
+		@functools.wraps(func)
+		def wrapper(*args):
+			return report_cache.get_or_compute((func.__name__,) + args, lambda: func(*args), ttl)
+		wrapper.versioned = lambda *args: report_cache.get_versioned((func.__name__,) + args, lambda: func(*args), ttl)
+		return wrapper
+	return decorator
+
+# Finished figures keyed by report and the version of the data they were built from; a hit skips building altogether.
+def cached_figure(key, version, build):
+	if version is None:
+		try:
+			return build()
+		except PartialResult as e:
+			return e.value
+	return figure_cache.get_or_compute(key + (version,), build, REPORT_TTL)
+
+time_series_tables = {
+	'bandwidth': {'columns': ['pageviews', 'users', 'date', 'description'], 'dimensions': []},
+	'os': {'columns': ['operatingSystem', 'users', 'date', 'description'], 'dimensions': ['operatingSystem']},
+	'browser': {'columns': ['browser', 'users', 'date', 'description'], 'dimensions': ['browser']},
+	'device': {'columns': ['deviceCategory', 'users', 'date', 'description'], 'dimensions': ['deviceCategory']},
+	'sessions': {'columns': ['sessions', 'bounceRate', 'hits', 'date', 'description'], 'dimensions': []},
+	'pageviews': {'columns': ['pageviews', 'pageviewsPerSession', 'uniquePageviews', 'avgTimeOnPage', 'date', 'description'], 'dimensions': []}
+}
+
+date_indexes_ready = set()
+date_indexes_lock = threading.Lock()
+
+def get_date_list(periods = 10):
+	date_list = pd.date_range(end = datetime.today(), periods = periods + 1).to_pydatetime().tolist()
+	date_list.pop()
+	return [i.strftime('%Y-%m-%d') for i in date_list]
+
+def ensure_date_indexes(cur, view = VIEW_ID):
+	if view in date_indexes_ready:
+		return
+	with date_indexes_lock:
+		if view in date_indexes_ready:
+			return
+		for table, spec in time_series_tables.items():
+			name = get_table_name(table, view)
+			if view != VIEW_ID:
+				cur.execute("create table if not exists {0}({1})".format(name, ', '.join('{0} text'.format(i) for i in spec['columns'])))
+			cur.execute("create index if not exists {0}_date_idx on {0} (date)".format(name))
+		cur.connection.commit()
+		date_indexes_ready.add(view)
+
+# One range query per table for the whole window; returns the stored rows grouped by day and the days that still have to come from GA.
+def read_time_series(cur, table, date_list, view = VIEW_ID):
+	ensure_date_indexes(cur, view)
+	columns = time_series_tables[table]['columns']
+	cur.execute("select {0} from {1} where date between %s and %s order by date".format(', '.join(columns), get_table_name(table, view)), (date_list[0], date_list[-1]))
+	found = {}
+	for row in cur.fetchall():
+		found.setdefault(str(row[columns.index('date')]), []).append(list(row))
+	missing = [i for i in date_list if i not in found]
+	return found, missing
+
+# With ga:date as the leading dimension one response covers several days; split it back into per-day rows in table order.
+def get_rows_by_date(response, table, date_list):
+	content = dict((i, []) for i in date_list)
+	for report in response.get('reports', []):
+		for row in report.get('data', {}).get('rows', []):
+			dimensions = row.get('dimensions', [])
+			date = '{0}-{1}-{2}'.format(dimensions[0][:4], dimensions[0][4:6], dimensions[0][6:])
+			if date not in content:
+				continue
+			dum = list(dimensions[1:])
+			for values in row.get('metrics', []):
+				dum.extend(values.get('values'))
+			dum.append(date)
+			dum.append('')
+			content[date].append(dum)
+	for i in date_list:
+		if len(content[i]) == 0:
+			content[i].append(empty_time_series_row(table, i))
+	return content
+
+def date_dimensions(end_date):
+	if end_date is None:
+		return []
+	return [{'name': 'ga:date'}]
+
+def empty_time_series_row(table, date):
+	dimensions = time_series_tables[table]['dimensions']
+	return [None if i in dimensions else '0' for i in time_series_tables[table]['columns'][:-2]] + [date, '']
+
+BULK_INSERT_ROWS = int(os.environ.get('BULK_INSERT_ROWS', '500'))
+
+# A value in COPY's text format: backslash escapes for the separators and \N for null.
+def get_copy_value(value):
+	if value is None:
+		return '\\N'
+	return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+# Many rows in few round trips: COPY on a psycopg2 cursor, otherwise parameterized multi-row inserts of BULK_INSERT_ROWS rows
+# each. COPY cannot resolve conflicts, so with `on_conflict` it is always the multi-row insert.
+def insert_rows(cur, name, columns, rows, on_conflict = None):
+	if len(rows) == 0:
+		return
+	if on_conflict is None and hasattr(cur, 'copy_expert'):
+		buf = io.StringIO(''.join('\t'.join(get_copy_value(i) for i in row) + '\n' for row in rows))
+		cur.copy_expert("copy {0}({1}) from stdin".format(name, ', '.join(columns)), buf)
+		return
+	for i in range(0, len(rows), BULK_INSERT_ROWS):
+		batch = rows[i:i + BULK_INSERT_ROWS]
+		values = ','.join(['(' + ','.join(['%s']*len(columns)) + ')']*len(batch))
+		cur.execute("insert into {0}({1}) values {2}{3}".format(name, ', '.join(columns), values, '' if on_conflict is None else ' ' + on_conflict), [value for row in batch for value in row])
+
+# The rows are also added to `stored`, to be written to the local store with write_stored() once the transaction commits.
+def store_time_series(cur, table, rows, view = VIEW_ID, stored = None):
+	ensure_rollups(cur, view)
+	insert_rows(cur, get_table_name(table, view), time_series_tables[table]['columns'], rows)
+	update_rollups(cur, table, rows, view)
+	if stored is not None:
+		stored.append((table, rows, view))
+
+# Days missing from the table are fetched with one request spanning the gap and stored. Without a fetch function the
+# read is read-only and days that have not been ingested yet show as zero rows.
+def fetch_time_series(cur, table, missing, fetch, view = VIEW_ID, stored = None):
+	if fetch is None:
+		return dict((i, [empty_time_series_row(table, i)]) for i in missing)
+	if len(missing) == 0:
+		return {}
+	fetched = get_rows_by_date(fetch(missing[0], missing[-1]), table, missing)
+	store_time_series(cur, table, [row for i in missing for row in fetched[i]], view, stored)
+	return fetched
+
+# Rows of the window in date order: the first stored row of each day, or everything fetched for the days that were missing.
+def load_time_series(cur, table, date_list, fetch = None, view = VIEW_ID, stored = None):
+	found, missing = read_time_series(cur, table, date_list, view)
+	fetched = fetch_time_series(cur, table, missing, fetch, view, stored)
+	content = []
+	for i in date_list:
+		if i in missing:
+			content.extend(fetched[i])
+		else:
+			content.append(found[i][0])
+	return content
+
+# Longer windows read pre-aggregated weekly or monthly rows instead of one row per day. The rollups hold sums only, so a
+# new day is added to its week and month with one upsert each and averages are derived again when the rows are read.
+OVERVIEW_WINDOWS = [7, 10, 30, 90, 365, 0]
+HISTORY_START = '2020-05-10'
+
+rollup_columns = {
+	'bandwidth': ['pageviews', 'users', 'bandwidth'],
+	'os': ['users'],
+	'browser': ['users'],
+	'device': ['users'],
+	'sessions': ['sessions', 'bounces', 'hits'],
+	'pageviews': ['pageviews', 'sessions', 'uniquePageviews', 'timeOnPage']
+}
+
+rollups_ready = set()
+rollups_lock = threading.Lock()
+
+# Windows up to a month are drawn per day, up to a year per week and beyond that per month; 0 stands for all time.
+def get_granularity(days):
+	if days == 0 or days > 365:
+		return 'monthly'
+	if days > 30:
+		return 'weekly'
+	return 'daily'
+
+def get_period_days(days):
+	return {'daily': 1, 'weekly': 7, 'monthly': 30}[get_granularity(days)]
+
+def get_period_name(days):
+	return {'daily': 'Day', 'weekly': 'Week', 'monthly': 'Month'}[get_granularity(days)]
+
+def get_window_label(days):
+	if days == 0:
+		return 'All Time'
+	return '{0} Days'.format(days)
+
+def get_window_start(days):
+	if days == 0:
+		return HISTORY_START
+	return get_date_list(days)[0]
+
+def get_period(date, granularity):
+	day = datetime.strptime(str(date)[:10], '%Y-%m-%d')
+	if granularity == 'weekly':
+		return (day - timedelta(days = day.weekday())).strftime('%Y-%m-%d')
+	return day.strftime('%Y-%m-01')
+
+def get_rollup_values(table, row):
+	values = dict(zip(time_series_tables[table]['columns'], row))
+	num = lambda name: float(values[name] or 0)
+	dimensions = time_series_tables[table]['dimensions']
+	dimension = values[dimensions[0]] or '' if dimensions else ''
+	if table == 'bandwidth':
+		return dimension, [num('pageviews'), num('users'), num('users')*num('pageviews')*1.55*4.5]
+	if table == 'sessions':
+		return dimension, [num('sessions'), num('bounceRate')*num('sessions')/100, num('hits')]
+	if table == 'pageviews':
+		sessions = num('pageviews')/num('pageviewsPerSession') if num('pageviewsPerSession') else 0
+		return dimension, [num('pageviews'), sessions, num('uniquePageviews'), num('avgTimeOnPage')*num('pageviews')]
+	return dimension, [num('users')]
+
+# Rollup tables are created next to the daily tables; the first time they appear they are filled from the days already stored.
+# Views already set up return before the lock, so a view holding an open transaction never waits on another view's setup.
+def ensure_rollups(cur, view = VIEW_ID):
+	if view in rollups_ready:
+		return
+	with rollups_lock:
+		if view in rollups_ready:
+			return
+		ensure_date_indexes(cur, view)
+		cur.execute("select pg_advisory_xact_lock(%s)", (zlib.crc32(('rollups:' + view).encode('utf-8')),))
+		for table, columns in rollup_columns.items():
+			for granularity in ('weekly', 'monthly'):
+				rollup = '{0}_{1}'.format(get_table_name(table, view), granularity)
+				cur.execute("select to_regclass(%s)", (rollup,))
+				if cur.fetchone()[0] is not None:
+					continue
+				cur.execute("create table if not exists {0}(period text, dimension text, {1}, primary key (period, dimension))".format(rollup, ', '.join('{0} double precision'.format(i) for i in columns)))
+				cur.execute("select {0} from {1}".format(', '.join(time_series_tables[table]['columns']), get_table_name(table, view)))
+				add_to_rollup(cur, table, granularity, cur.fetchall(), view)
+		cur.connection.commit()
+		rollups_ready.add(view)
+
+def add_to_rollup(cur, table, granularity, rows, view = VIEW_ID):
+	columns = rollup_columns[table]
+	date_index = time_series_tables[table]['columns'].index('date')
+	totals = {}
+	for row in rows:
+		dimension, values = get_rollup_values(table, row)
+		key = (get_period(row[date_index], granularity), dimension)
+		totals[key] = [a + b for a, b in zip(totals.get(key, [0]*len(columns)), values)]
+	rollup = '{0}_{1}'.format(get_table_name(table, view), granularity)
+	on_conflict = "on conflict (period, dimension) do update set {0}".format(', '.join('{0} = {1}.{0} + excluded.{0}'.format(i, rollup) for i in columns))
+	insert_rows(cur, rollup, ['period', 'dimension'] + columns, [[period, dimension] + values for (period, dimension), values in totals.items()], on_conflict)
+
+def update_rollups(cur, table, rows, view = VIEW_ID):
+	for granularity in ('weekly', 'monthly'):
+		add_to_rollup(cur, table, granularity, rows, view)
+
+def read_rollup_sums(cur, table, days, view = VIEW_ID):
+	ensure_rollups(cur, view)
+	granularity = get_granularity(days)
+	cur.execute("select period, dimension, {0} from {1}_{2} where period >= %s order by period".format(', '.join(rollup_columns[table]), get_table_name(table, view), granularity), (get_period(get_window_start(days), granularity),))
+	return pd.DataFrame(cur.fetchall(), columns=['period', 'dimension'] + rollup_columns[table])
+
+# Daily rows turned into the same sums the rollups hold, so views can be added together before averages are derived.
+def get_daily_sums(table, dataf):
+	rows = []
+	for row in dataf.itertuples(index=False):
+		dimension, values = get_rollup_values(table, list(row))
+		rows.append([row[time_series_tables[table]['columns'].index('date')], dimension] + values)
+	return pd.DataFrame(rows, columns=['period', 'dimension'] + rollup_columns[table])
+
+# Rollup sums as a frame with the same columns the daily rows have, averages recomputed from the sums.
+def get_rollup_frame(table, sums, columns):
+	dataf = pd.DataFrame({'date': sums['period'], columns[-1]: ''})
+	if table == 'bandwidth':
+		dataf['pageviews'] = sums['pageviews'].astype(int)
+		dataf['users'] = sums['users'].astype(int)
+		dataf['bandwidth'] = sums['bandwidth'].round(2)
+	elif table == 'sessions':
+		dataf['sessions'] = sums['sessions'].astype(int)
+		dataf['bounceRate'] = (sums['bounces']/sums['sessions'].where(sums['sessions'] > 0)*100).fillna(0)
+		dataf['hits'] = sums['hits'].astype(int)
+	elif table == 'pageviews':
+		dataf['pageviews'] = sums['pageviews']
+		dataf['pageviewsPerSession'] = (sums['pageviews']/sums['sessions'].where(sums['sessions'] > 0)).fillna(0)
+		dataf['uniquePageviews'] = sums['uniquePageviews']
+		dataf['avgTimeOnPage'] = (sums['timeOnPage']/sums['pageviews'].where(sums['pageviews'] > 0)).fillna(0)
+	else:
+		dataf[columns[0]] = sums['dimension'].where(sums['dimension'] != '', None)
+		dataf['users'] = sums['users'].astype(int)
+	return dataf
+
+# History that has been ingested is also kept in a local columnar store: one .npy file per column and month under
+# STORE_DIR/<table>/<YYYY-MM>/, dimensions dictionary-encoded next to a .json list of their values. Scans memory-map only
+# the requested columns and slice them by date, so the dashboard can serve stored days without a trip to Postgres.
+# <YYYY-MM> is a symlink to a directory written whole and never changed, and a write links a new one in its place, so a
+# reader resolving the link once sees one version of every column. Writers of a table take a file lock on it.
+STORE_DIR = os.environ.get('STORE_DIR', '.store')
+
+store_types = {'date': 'datetime64[D]', 'pageviews': 'int64', 'users': 'int64', 'sessions': 'int64', 'hits': 'int64', 'uniquePageviews': 'int64'}
+
+class ColumnStore:
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.Lock()
+
+	def get_partition(self, table, month, view = VIEW_ID):
+		return os.path.join(self.path, get_table_name(table, view), month)
+
+	@contextmanager
+	def locked(self, table, view = VIEW_ID):
+		directory = os.path.join(self.path, get_table_name(table, view))
+		os.makedirs(directory, exist_ok=True)
+		with self.lock, open(os.path.join(directory, '.lock'), 'a') as f:
+			fcntl.flock(f, fcntl.LOCK_EX)
+			try:
+				yield
+			finally:
+				fcntl.flock(f, fcntl.LOCK_UN)
+
+	def get_months(self, table, start, end, view = VIEW_ID):
+		path = os.path.join(self.path, get_table_name(table, view))
+		if not os.path.isdir(path):
+			return []
+		return sorted(i for i in os.listdir(path) if start[:7] <= i <= end[:7] and '.' not in i)
+
+	# Columns of one partition, memory-mapped; None when the partition is missing or caught halfway through a write.
+	def load_partition(self, table, month, columns, mmap_mode = 'r', view = VIEW_ID):
+		partition = os.path.realpath(self.get_partition(table, month, view))
+		data = OrderedDict()
+		try:
+			for column in ['date'] + [i for i in columns if i != 'date']:
+				data[column] = np.load(os.path.join(partition, column + '.npy'), mmap_mode = mmap_mode)
+				if column in time_series_tables[table]['dimensions']:
+					with open(os.path.join(partition, column + '.json')) as f:
+						data[column + '.json'] = json.load(f)
+		except (IOError, ValueError):
+			return None
+		if len(set(len(v) for k, v in data.items() if not k.endswith('.json'))) > 1:
+			return None
+		return data
+
+	# Column arrays of the rows between start and end inclusive. A single partition is returned as views of the mapped
+	# files; dimensions are decoded to their values.
+	def scan(self, table, columns, start, end, view = VIEW_ID):
+		dimensions = time_series_tables[table]['dimensions']
+		parts = []
+		for month in self.get_months(table, start, end, view):
+			data = self.load_partition(table, month, columns, view = view)
+			if data is None:
+				continue
+			dates = data['date']
+			lo, hi = np.searchsorted(dates, np.datetime64(start, 'D')), np.searchsorted(dates, np.datetime64(end, 'D'), side = 'right')
+			part = OrderedDict()
+			for column in columns:
+				if column in dimensions:
+					values = np.array(data[column + '.json'] + [None], dtype = object)
+					part[column] = values[data[column][lo:hi]]
+				else:
+					part[column] = data[column][lo:hi]
+			parts.append(part)
+		if len(parts) == 1:
+			return parts[0]
+		if len(parts) == 0:
+			return OrderedDict((i, np.array([], dtype = object if i in dimensions else store_types.get(i, np.float64))) for i in columns)
+		return OrderedDict((i, np.concatenate([part[i] for part in parts])) for i in columns)
+
+	# Rows in table column order; days already in the store are replaced by the rows written for them.
+	def write(self, table, rows, view = VIEW_ID):
+		columns = time_series_tables[table]['columns'][:-1]
+		dimensions = time_series_tables[table]['dimensions']
+		date_index = columns.index('date')
+		months = {}
+		for row in rows:
+			months.setdefault(str(row[date_index])[:7], []).append(row)
+		with self.locked(table, view):
+			for month, month_rows in months.items():
+				data = OrderedDict((i, []) for i in columns)
+				days = set(np.datetime64(str(row[date_index])[:10], 'D') for row in month_rows)
+				old = self.load_partition(table, month, columns, mmap_mode = None, view = view)
+				if old is not None:
+					keep = ~np.isin(old['date'], list(days))
+					for column in columns:
+						if column in dimensions:
+							values = np.array(old[column + '.json'] + [None], dtype = object)
+							data[column].extend(values[old[column][keep]].tolist())
+						else:
+							data[column].extend(old[column][keep].tolist())
+				for row in month_rows:
+					for column, value in zip(columns, row):
+						data[column].append(str(value)[:10] if column == 'date' else value)
+				order = np.argsort(np.array(data['date'], dtype = 'datetime64[D]'), kind = 'stable')
+				self.write_partition(table, month, data, order, view)
+
+	# Writes the columns into a new <YYYY-MM>.<token> directory, links it in and removes the versions before the one it
+	# replaced; a reader still loading that one finds it gone and falls back to the database.
+	def write_partition(self, table, month, data, order, view = VIEW_ID):
+		link = self.get_partition(table, month, view)
+		directory = os.path.dirname(link)
+		version = '{0}.{1:x}-{2}-{3:x}'.format(month, int(time.time()*1000000), os.getpid(), random.getrandbits(32))
+		partition = os.path.join(directory, version)
+		os.makedirs(partition)
+		for column, values in data.items():
+			target = os.path.join(partition, column + '.npy')
+			if column == 'date':
+				array = np.array(values, dtype = 'datetime64[D]')
+			elif column in time_series_tables[table]['dimensions']:
+				categories = sorted(set(i for i in values if i is not None))
+				codes = dict((v, i) for i, v in enumerate(categories))
+				array = np.array([codes.get(i, -1) for i in values], dtype = np.int32)
+				with open(target[:-4] + '.json', 'w') as f:
+					json.dump(categories, f)
+			else:
+				array = np.array(values, dtype = np.float64).astype(store_types.get(column, np.float64))
+			with open(target, 'wb') as f:
+				np.save(f, array[order])
+		previous = os.readlink(link) if os.path.islink(link) else None
+		# A partition written before partitions were linked is moved aside and removed like an old version.
+		if previous is None and os.path.isdir(link):
+			os.rename(link, link + '.unlinked')
+		tmp = '{0}.{1}.link'.format(link, os.getpid())
+		os.symlink(version, tmp)
+		os.replace(tmp, link)
+		for name in os.listdir(directory):
+			if name.startswith(month + '.') and name not in (version, previous):
+				path = os.path.join(directory, name)
+				if os.path.islink(path):
+					os.remove(path)
+				else:
+					shutil.rmtree(path, ignore_errors=True)
+
+	# The first stored row of every day of date_list as a frame with `columns` for names, built from the scanned arrays;
+	# None unless the store has every day.
+	def frame(self, table, date_list, columns, view = VIEW_ID):
+		table_columns = time_series_tables[table]['columns'][:-1]
+		data = self.scan(table, table_columns, date_list[0], date_list[-1], view)
+		days, first = np.unique(data['date'], return_index = True)
+		if len(days) < len(date_list):
+			return None
+		if len(first) < len(data['date']):
+			data = OrderedDict((i, data[i][first]) for i in table_columns)
+		frame = OrderedDict((name, data[column]) for name, column in zip(columns, table_columns))
+		frame[columns[table_columns.index('date')]] = np.datetime_as_string(days)
+		frame[columns[-1]] = ''
+		return pd.DataFrame(frame, columns = columns)
+
+	# Days of `found` (rows grouped by day) that the store does not have yet.
+	def get_missing(self, table, found, view = VIEW_ID):
+		if len(found) == 0:
+			return []
+		days = sorted(found)
+		stored = set(np.datetime_as_string(self.scan(table, ['date'], days[0], days[-1], view)['date']))
+		return [i for i in days if i not in stored]
+
+column_store = ColumnStore(STORE_DIR) if STORE_DIR else None
+
+# The store only saves trips to the database, so failing to write it is logged and otherwise ignored.
+def write_store(table, rows, view = VIEW_ID):
+	if column_store is None or len(rows) == 0:
+		return
+	try:
+		column_store.write(table, rows, view)
+	except Exception:
+		logger.exception('Writing %s rows of %s to the local store failed', len(rows), get_table_name(table, view))
+
+# Only what the database has committed reaches the local store, so it never serves days a failed transaction lost.
+def write_stored(stored):
+	for table, rows, view in stored:
+		write_store(table, rows, view)
+
+# Ingestion also copies over stored days the local store lacks, e.g. those ingested before it existed. Reads never write it.
+def fill_store(table, found, view = VIEW_ID):
+	if column_store is None:
+		return
+	try:
+		missing = column_store.get_missing(table, found, view)
+	except Exception:
+		logger.exception('Reading the local store of %s failed', get_table_name(table, view))
+		return
+	write_store(table, [row for i in missing for row in found[i]], view)
+
+def read_rollup(table, days, view = VIEW_ID):
+	with db_pool.connection() as conn:
+		cur = conn.cursor()
+
+		sums = read_rollup_sums(cur, table, days, view)
+
+		conn.commit()
+		cur.close()
+	return sums
+
+# Daily windows the local store fully covers are served from it; anything else goes through the database. `fetch` gets
+# the view to fetch for as a keyword argument.
+def load_view_window(table, days, columns, fetch = None, view = VIEW_ID):
+	if get_granularity(days) != 'daily':
+		return get_rollup_frame(table, read_rollup(table, days, view), columns)
+	date_list = get_date_list(days)
+	if column_store is not None:
+		dataf = column_store.frame(table, date_list, columns, view)
+		if dataf is not None:
+			return dataf
+	if fetch is not None:
+		fetch = functools.partial(fetch, view = view)
+	stored = []
+	with db_pool.connection() as conn:
+		cur = conn.cursor()
+
+		dataf = pd.DataFrame(load_time_series(cur, table, date_list, fetch, view, stored), columns=columns)
+
+		conn.commit()
+		cur.close()
+	write_stored(stored)
+	return dataf
+
+def load_view_sums(table, days, columns, fetch = None, view = VIEW_ID):
+	if get_granularity(days) == 'daily':
+		return get_daily_sums(table, load_view_window(table, days, columns, fetch, view))
+	return read_rollup(table, days, view)
+
+# The window of one view, or with ALL_VIEWS the sums of every view added up per period before averages are derived.
+async def load_window_async(table, days, columns, fetch = None, view = VIEW_ID):
+	if view != ALL_VIEWS:
+		return await async_access.db(load_view_window, table, days, columns, fetch, view)
+	sums = pd.concat(await gather_views('db', load_view_sums, view, table, days, columns, fetch), ignore_index=True)
+	return get_rollup_frame(table, sums.groupby(['period', 'dimension'], as_index=False).sum(), columns)
+
+def load_window(table, days, columns, fetch = None, view = VIEW_ID):
+	return async_access.gather(load_window_async(table, days, columns, fetch, view))[0]
 
 app = dash.Dash(__name__, meta_tags=[{'name': 'viewport','content': 'width=device-width, initial-scale=1.0'}])
 
-# server = app.server			for Heroku Hosting Purpose
+server = app.server
 
 app.config['suppress_callback_exceptions'] = True
 
-app.layout = html.Div(style={'height' : '100%', 'margin' : '0px'}, children=[
-	html.H1(
-		className="h1-1",
-		children='Traffic Analysis',
-		style={
+# Built on the first page load rather than at import, and only once per process.
+@functools.lru_cache()
+def serve_layout():
+	return html.Div(style={'height' : '100%', 'margin' : '0px'}, children=[
+		html.H1(
+			className="h1-1",
+			children='Traffic Analysis',
+			style={
+				'textAlign': 'center',
+				'color': 'white'
+			}
+		),
+		html.Div(className = "div-1",children='Real-Time Measurement and Analysis of Internet Traffic', style={
 			'textAlign': 'center',
-			'color': 'white'
-		}
-	),
-	html.Div(className = "div-1",children='Real-Time Measurement and Analysis of Internet Traffic', style={
-		'textAlign': 'center',
-		'color': 'black',
-		'fontSize': '20px',
-		'fontWeight': '630'
-	}),
-	html.Div(
-	[
+			'color': 'black',
+			'fontSize': '20px',
+			'fontWeight': '630'
+		}),
 		html.Div(
 		[
-			dcc.RadioItems(
-				options=[
-					{'label': 'Overview', 'value': 'OR'},
-					{'label': 'Real-Time', 'value': 'RT'}
-				],
-				value='OR',
-				labelStyle = {'display' : 'block', 'padding' : '5px'},
-				id = 'radio-button-1'
+			html.Div(
+			[
+				dcc.RadioItems(
+					options=[
+						{'label': 'Overview', 'value': 'OR'},
+						{'label': 'Real-Time', 'value': 'RT'}
+					],
+					value='OR',
+					labelStyle = {'display' : 'block', 'padding' : '5px'},
+					id = 'radio-button-1'
+				),
+				dcc.Dropdown(
+					options=[{'label': 'All Views', 'value': ALL_VIEWS}] + [{'label': 'View ' + i, 'value': i} for i in VIEW_IDS],
+					value=DEFAULT_VIEW,
+					clearable=False,
+					id='view-select',
+					style={'display': 'block' if len(VIEW_IDS) > 1 else 'none', 'margin-top': '10px'}
+				)
+			],
+			className = 'div-2',
+			style = {'float':'left'}
+			),
+			html.Div(
+			[
+				dcc.Tabs(id="tabs"),
+				html.Div(id='tabs-content', style = {'padding' : '10px'}),
+				dcc.Store(id='navigation', data=get_navigation())
+			],
+			className = 'div-3',
+			style = {'float':'left', 'margin-top': '1%', 'margin-bottom': '1%', 'width': '84%','height': '660px', 'background-color': 'white', 'border-radius': '20px' }
 			)
-		],
-		className = 'div-2',
-		style = {'float':'left'}
-		),
-		html.Div(
-		[
-			dcc.Tabs(id="tabs"),
-			html.Div(id='tabs-content', style = {'padding' : '10px'})
-		],
-		className = 'div-3',
-		style = {'float':'left', 'margin-top': '1%', 'margin-bottom': '1%', 'width': '84%','height': '660px', 'background-color': 'white', 'border-radius': '20px' }
+		]
 		)
-	]
-	)
-])
+	])
+
+app.layout = serve_layout
+
+# Switching between Overview and Real-Time and between tabs needs no data, so it runs in the browser (assets/clientside.js)
+# from this, which is built once with the layout. The server is only called by the data callbacks of the tab shown.
+def get_navigation():
+	return {
+		'tabs': {mode: set_tab_options(mode) for mode in ('OR', 'RT')},
+		'values': {mode: set_cities_value(mode) for mode in ('OR', 'RT')},
+		'contents': {tab: render_content(tab) for tab in ('tab-1', 'tab-2', 'tab-3')}
+	}
+
+app.clientside_callback(
+	ClientsideFunction(namespace='navigation', function_name='set_tabs'),
+	[Output('tabs', 'children'), Output('tabs', 'value')],
+	[Input('radio-button-1', 'value')],
+	[State('navigation', 'data')]
+)
+
+app.clientside_callback(
+	ClientsideFunction(namespace='navigation', function_name='render_content'),
+	Output('tabs-content', 'children'),
+	[Input('tabs', 'value')],
+	[State('navigation', 'data')]
+)
 
-@app.callback(Output('tabs', 'children'), [Input('radio-button-1', 'value')])
 def set_tab_options(selected_option):
 	if selected_option=="OR":
 		return [
@@ -162,14 +2082,12 @@ def set_tab_options(selected_option):
 			dcc.Tab(label='Geographic', value='tab-3'),
 		]
 
-@app.callback(Output('tabs', 'value'), [Input('radio-button-1', 'value')])
 def set_cities_value(selected_option):
 	if selected_option=="OR":
 		return "tab-1"
 	elif selected_option=="RT":
 		return "tab-3"
 
-@app.callback(Output('tabs-content', 'children'), [Input('tabs', 'value')])
 def render_content(tab):
 	if tab == 'tab-1':
 		return html.Div(
@@ -208,9 +2126,15 @@ def render_content(tab):
 			[
 				html.Div(
 					[
+						dcc.RadioItems(
+							options=[{'label': get_window_label(i), 'value': i} for i in OVERVIEW_WINDOWS],
+							value=10,
+							labelStyle = {'display' : 'inline-block', 'padding' : '5px'},
+							style = {'display': 'flex', 'justify-content': 'center', 'backgroundColor' : '#ffea9e', 'border-radius' : '15px'},
+							id = 'radio-button-window'
+						),
 						dcc.Graph(
 							id='plots-graph-1',
-							figure=subplot_overview(),
 							style = {'display': 'flex', 'align-items': 'center', 'justify-content': 'center'}
 						),
 					]
@@ -250,550 +2174,330 @@ def render_content(tab):
 			style = {'display': 'flex', 'align-items': 'center', 'justify-content': 'center'}
 			)
 
-def subplot_overview():
+# Panel builders of the overview in the order their traces are added, with the subplot cell of each returned trace.
+# Panels drawn over the selected window; users and the overall table always cover the whole history.
+def get_overview_panels(days, view):
+	return [
+		(plot_bandwidth, (days, view), [(1,1),(1,1)]),
+		(plot_system, (days, view), [(1,2),(1,2),(1,2)]),
+		(plot_sessions, (days, view), [(2,1),(2,1),(2,1)]),
+		(plot_pageviews, (days, view), [(2,2),(2,2),(2,2),(2,2)]),
+		(plot_users, (view,), [(1,3)]),
+		(plot_overall, (view,), [(2,3)])
+	]
+
+# Layout of the empty 2x3 grid and the axis or domain reference of each cell, computed by plotly once per process.
+@functools.lru_cache()
+def get_overview_skeleton():
 	plots = subplots.make_subplots(
 		rows=2,cols=3,
 		specs= [[{'type':'bar'},{'type':'scatter'},{'type':'pie'}],
 				[{'type':'scatter'},{'type':'scatter'},{'type':'table'}]],
 		shared_xaxes = True
 	)
-	fig1,fig2 = plot_bandwidth()
-	plots.add_trace(fig1,1,1)
-	plots.add_trace(fig2,1,1)
-	fig3, fig4, fig5 = plot_system()
-	plots.add_trace(fig3,1,2)
-	plots.add_trace(fig4,1,2)
-	plots.add_trace(fig5,1,2)
-	fig6, fig7, fig8 = plot_sessions()
-	plots.add_trace(fig6,2,1)
-	plots.add_trace(fig7,2,1)
-	plots.add_trace(fig8,2,1)
-	fig9, fig10, fig11, fig12 = plot_pageviews()
-	plots.add_trace(fig9,2,2)
-	plots.add_trace(fig10,2,2)
-	plots.add_trace(fig11,2,2)
-	plots.add_trace(fig12,2,2)
-	fig13 = plot_users()
-	plots.add_trace(fig13,1,3)
-	fig14 = plot_overall()
-	plots.add_trace(fig14,2,3)
-	plots.update_layout(
-		dict(
-			template = "plotly_dark",
+	cells = {}
+	for row in (1, 2):
+		for col in (1, 2, 3):
+			subplot = plots.get_subplot(row, col)
+			if hasattr(subplot, 'xaxis'):
+				cells[(row, col)] = {'xaxis': subplot.xaxis.plotly_name.replace('axis', ''), 'yaxis': subplot.yaxis.plotly_name.replace('axis', '')}
+			else:
+				cells[(row, col)] = {'domain': {'x': list(subplot.x), 'y': list(subplot.y)}}
+	return plots.layout.to_plotly_json(), cells
+
+# An overview with a failed or timed out panel is served but not cached, so the next request tries the panel again.
+def subplot_overview(days = 10, view = DEFAULT_VIEW):
+	def build():
+		figure, complete = build_overview(days, view)
+		if not complete:
+			raise PartialResult(figure)
+		return figure
+	return cached_figure(('overview', days, view), get_data_version(), build)
+
+# The figure, and whether every panel made it into it.
+def build_overview(days = 10, view = DEFAULT_VIEW):
+	layout, cells = get_overview_skeleton()
+	data = []
+	complete = True
+	panels = get_overview_panels(days, view)
+	futures = [overview_executor.submit(panel, *args) for panel, args, panel_cells in panels]
+	deadline = time.time() + OVERVIEW_TIMEOUT
+	for future, (panel, args, panel_cells) in zip(futures, panels):
+		try:
+			figs = future.result(timeout = max(0, deadline - time.time()))
+		except futures_timeout:
+			logger.warning('Overview panel %s timed out after %ss', panel.__name__, OVERVIEW_TIMEOUT)
+			complete = False
+			continue
+		except Exception:
+			logger.exception('Overview panel %s failed', panel.__name__)
+			complete = False
+			continue
+		if len(panel_cells) == 1:
+			figs = (figs,)
+		for fig, cell in zip(figs, panel_cells):
+			data.append(dict(fig, **cells[cell]))
+	figure = {
+		'data': data,
+		'layout': dict(
+			layout,
+			template = get_template('plotly_dark'),
 			width = 1250,
 			height = 570,
 			margin = {'l':5,'r':5,'b':5,'t':40},
 			title = dict(text="Overall Analysis"),
 			font = dict(family='Comic Sans MS', size=13)
 		)
-	)
-	return plots
-
-def get_value_bandwidth(date):
-	SCOPES = ['https://www.googleapis.com/auth/analytics.readonly']
-	KEY_FILE_LOCATION = 'YOUR CREDENTIAL FILE LOCATION'
-	VIEW_ID = 'YOUR VIEW ID'
-	credentials = ServiceAccountCredentials.from_json_keyfile_name(KEY_FILE_LOCATION, SCOPES)
-	analytics = build('analyticsreporting', 'v4', credentials=credentials)
-	response = analytics.reports().batchGet(
+	}
+	return figure, complete
+
+@app.callback(Output('plots-graph-1', 'figure'), [Input('radio-button-window', 'value'), Input('view-select', 'value')])
+@timed
+def update_overview(days, view):
+	check_view(view)
+	return subplot_overview(days, view)
+
+def get_value_bandwidth(date, end_date = None, view = VIEW_ID):
+	analytics = get_analytics()
+	response = execute_ga(analytics.reports().batchGet(
 					body={
 						'reportRequests': [
 						{
-							'viewId': VIEW_ID,
-							'dateRanges': [{'startDate': date, 'endDate': date}],
+							'viewId': view,
+							'dateRanges': [{'startDate': date, 'endDate': end_date or date}],
+							'dimensions': date_dimensions(end_date),
+							'pageSize': 10000,
 							'metrics': [{'expression': 'ga:pageviews'},{'expression': 'ga:users'}],
 						}]
 					}
-				).execute()
+				), 'bandwidth')
 	return response
 
-def plot_bandwidth():
-	conn = psycopg2.connect(DATABASE_URL)
-	cur = conn.cursor()
+def plot_bandwidth(days = 10, view = DEFAULT_VIEW):
+	dataf = load_window('bandwidth', days, column_names_bandwidth, callback_fetch(get_value_bandwidth), view)
 
-	today_date = datetime.today().strftime('%Y-%m-%d')
-	date_list = pd.date_range(end = datetime.today(), periods = 11).to_pydatetime().tolist()
-	date_list.pop()
-	for i in range(len(date_list)):
-		date_list[i] = date_list[i].strftime('%Y-%m-%d')
-	content = []
-	query = "select pageviews, users, date, description from bandwidth where date = \'{0}\'"
-	for i in date_list:
-		cur.execute(query.format(i))
-		result = cur.fetchall()
-		if len(result) == 0:
-			response = get_value_bandwidth(i)
-			for report in response.get('reports', []):
-				columnHeader = report.get('columnHeader', {})
-				dimensionHeaders = columnHeader.get('dimensions', [])
-				metricHeaders = columnHeader.get('metricHeader', {}).get('metricHeaderEntries', [])
-				if 'rows' not in list(report.get('data', {}).keys()):
-					cur.execute("insert into bandwidth(pageviews, users, date, description) values(\'{0}\',\'{1}\',\'{2}\',\'{3}\')".format("0","0",i,""))
-					content.append(['0','0',i,''])
-				for row in report.get('data', {}).get('rows', []):
-					dum = []
-					dimensions = row.get('dimensions', [])
-					dateRangeValues = row.get('metrics', [])
-					for header, dimension in zip(dimensionHeaders, dimensions):
-						dum.append(dimension)
-					for values in dateRangeValues:
-						for value in values.get('values'):
-							dum.append(value)
-						dum.append(i)
-						dum.append('')
-					cur.execute("insert into bandwidth(pageviews, users, date, description) values(\'{0}\',\'{1}\',\'{2}\',\'{3}\')".format(dum[0],dum[1],dum[2],dum[3]))
-					content.append(dum)
-		else:
-			content.append(list(result[0]))
-	dataf = pd.DataFrame(content, columns=column_names_bandwidth)
-	dataf['bandwidth'] = (dataf['users'].astype(int)*dataf['pageviews'].astype(int)*1.55*4.5).map('{:.2f}'.format).astype(float)
-	dataf['avgBandwidth'] = (dataf['bandwidth']/dataf['users'].astype(int)).map('{:.2f}'.format).astype(float)
-	dataf['text'] = 'Users : '+dataf['users']+'<br>'+'Total Bandwidth per Day : '+dataf['bandwidth'].astype(str)+ " MBps"
-	fig1 = go.Bar(x=dataf['date'], y=dataf['bandwidth'], marker = dict(color='indianred'), text = dataf['text'], name="Bandwidth")
-	fig2 = go.Bar(x=dataf['date'], y=dataf['avgBandwidth'], marker = dict(color='lightsalmon'), text = 'Avg. Bandwidth per User : '+dataf['avgBandwidth'].astype(str)+" MBps", name="Avg. Bandwidth")
-	conn.commit()
-	cur.close()
-	conn.close()
+	if 'bandwidth' not in dataf:
+		dataf['bandwidth'] = (dataf['users'].astype(int)*dataf['pageviews'].astype(int)*1.55*4.5).round(2)
+	dataf['avgBandwidth'] = (dataf['bandwidth']/dataf['users'].astype(int)).round(2)
+	dataf['text'] = 'Users : '+dataf['users'].astype(str)+'<br>'+'Total Bandwidth per {0} : '.format(get_period_name(days))+dataf['bandwidth'].astype(str)+ " MBps"
+	fig1 = dict(type='bar', x=dataf['date'].tolist(), y=dataf['bandwidth'].tolist(), marker = dict(color='indianred'), text = dataf['text'].tolist(), name="Bandwidth")
+	fig2 = dict(type='bar', x=dataf['date'].tolist(), y=dataf['avgBandwidth'].tolist(), marker = dict(color='lightsalmon'), text = ('Avg. Bandwidth per User : '+dataf['avgBandwidth'].astype(str)+" MBps").tolist(), name="Avg. Bandwidth")
 	return fig1, fig2
 
-def get_value_system1(date):
-	SCOPES = ['https://www.googleapis.com/auth/analytics.readonly']
-	KEY_FILE_LOCATION = 'YOUR CREDENTIAL FILE LOCATION'
-	VIEW_ID = 'YOUR VIEW ID'
-	credentials = ServiceAccountCredentials.from_json_keyfile_name(KEY_FILE_LOCATION, SCOPES)
-	analytics = build('analyticsreporting', 'v4', credentials=credentials)
-	response1 = analytics.reports().batchGet(
+def get_value_system1(date, end_date = None, view = VIEW_ID):
+	analytics = get_analytics()
+	response1 = execute_ga(analytics.reports().batchGet(
 					body={
 						'reportRequests': [
 						{
-							'viewId': VIEW_ID,
-							'dateRanges': [{'startDate': date, 'endDate': date}],
-							'dimensions': [{'name': 'ga:operatingSystem'}],
+							'viewId': view,
+							'dateRanges': [{'startDate': date, 'endDate': end_date or date}],
+							'dimensions': date_dimensions(end_date) + [{'name': 'ga:operatingSystem'}],
+							'pageSize': 10000,
 							'metrics' : [{'expression':'ga:users'}]
 						}]
 					}
-				).execute()
+				), 'os')
 	return response1
-def get_value_system2(date):
-	SCOPES = ['https://www.googleapis.com/auth/analytics.readonly']
-	KEY_FILE_LOCATION = 'YOUR CREDENTIAL FILE LOCATION'
-	VIEW_ID = 'YOUR VIEW ID'
-	credentials = ServiceAccountCredentials.from_json_keyfile_name(KEY_FILE_LOCATION, SCOPES)
-	analytics = build('analyticsreporting', 'v4', credentials=credentials)
-	response2 = analytics.reports().batchGet(
+def get_value_system2(date, end_date = None, view = VIEW_ID):
+	analytics = get_analytics()
+	response2 = execute_ga(analytics.reports().batchGet(
 					body={
 						'reportRequests': [
 						{
-							'viewId': VIEW_ID,
-							'dateRanges': [{'startDate': date, 'endDate': date}],
-							'dimensions': [{'name': 'ga:browser'}],
+							'viewId': view,
+							'dateRanges': [{'startDate': date, 'endDate': end_date or date}],
+							'dimensions': date_dimensions(end_date) + [{'name': 'ga:browser'}],
+							'pageSize': 10000,
 							'metrics' : [{'expression':'ga:users'}]
 						}]
 					}
-				).execute()
+				), 'browser')
 	return response2
-def get_value_system3(date):
-	SCOPES = ['https://www.googleapis.com/auth/analytics.readonly']
-	KEY_FILE_LOCATION = 'YOUR CREDENTIAL FILE LOCATION'
-	VIEW_ID = 'YOUR VIEW ID'
-	credentials = ServiceAccountCredentials.from_json_keyfile_name(KEY_FILE_LOCATION, SCOPES)
-	analytics = build('analyticsreporting', 'v4', credentials=credentials)
-	response3 = analytics.reports().batchGet(
+def get_value_system3(date, end_date = None, view = VIEW_ID):
+	analytics = get_analytics()
+	response3 = execute_ga(analytics.reports().batchGet(
 					body={
 						'reportRequests': [
 						{
-							'viewId': VIEW_ID,
-							'dateRanges': [{'startDate': date, 'endDate': date}],
-							'dimensions': [{'name': 'ga:deviceCategory'}],
+							'viewId': view,
+							'dateRanges': [{'startDate': date, 'endDate': end_date or date}],
+							'dimensions': date_dimensions(end_date) + [{'name': 'ga:deviceCategory'}],
+							'pageSize': 10000,
 							'metrics' : [{'expression':'ga:users'}]
 						}]
 					}
-				).execute()
+				), 'device')
 	return response3
 
-def plot_system():
-	conn = psycopg2.connect(DATABASE_URL)
-	cur = conn.cursor()
+def plot_system(days = 10, view = DEFAULT_VIEW):
+	dataf1, dataf2, dataf3 = async_access.gather(
+		load_window_async('os', days, column_names_os, callback_fetch(get_value_system1), view),
+		load_window_async('browser', days, column_names_browser, callback_fetch(get_value_system2), view),
+		load_window_async('device', days, column_names_device, callback_fetch(get_value_system3), view)
+	)
 
-	today_date = datetime.today().strftime('%Y-%m-%d')
-	date_list = pd.date_range(end = datetime.today(), periods = 11).to_pydatetime().tolist()
-	date_list.pop()
-	for i in range(len(date_list)):
-		date_list[i] = date_list[i].strftime('%Y-%m-%d')
-	content1, content2, content3 = [], [], []
-	query1 = "select operatingSystem, users, date, description from os where date = \'{0}\'"
-	query2 = "select browser, users, date, description from browser where date = \'{0}\'"
-	query3 = "select deviceCategory, users, date, description from device where date = \'{0}\'"
-	for i in date_list:
-		cur.execute(query1.format(i))
-		result1 = cur.fetchall()
-		cur.execute(query2.format(i))
-		result2 = cur.fetchall()
-		cur.execute(query3.format(i))
-		result3 = cur.fetchall()
-
-		if len(result1)==0:
-			response1 = get_value_system1(i)
-			for report in response1.get('reports', []):
-				columnHeader = report.get('columnHeader', {})
-				dimensionHeaders = columnHeader.get('dimensions', [])
-				metricHeaders = columnHeader.get('metricHeader', {}).get('metricHeaderEntries', [])
-				if 'rows' not in list(report.get('data', {}).keys()):
-					cur.execute("insert into os(operatingSystem, users, date, description) values({0},\'{1}\',\'{2}\',\'{3}\')".format("NULL","0",i,""))
-					content1.append([None,'0',i,''])
-				for row in report.get('data', {}).get('rows', []):
-					dum = []
-					dimensions = row.get('dimensions', [])
-					dateRangeValues = row.get('metrics', [])
-					for header, dimension in zip(dimensionHeaders, dimensions):
-						dum.append(dimension)
-					for values in dateRangeValues:
-						for value in values.get('values'):
-							dum.append(value)
-						dum.append(i)
-						dum.append('')
-					cur.execute("insert into os(operatingSystem, users, date, description) values(\'{0}\',\'{1}\',\'{2}\',\'{3}\')".format(dum[0],dum[1],dum[2],dum[3]))
-					content1.append(dum)
-		else:
-			content1.append(list(result1[0]))
-
-		if len(result2)==0:
-			response2 = get_value_system2(i)
-			for report in response2.get('reports', []):
-				columnHeader = report.get('columnHeader', {})
-				dimensionHeaders = columnHeader.get('dimensions', [])
-				metricHeaders = columnHeader.get('metricHeader', {}).get('metricHeaderEntries', [])
-				if 'rows' not in list(report.get('data', {}).keys()):
-					cur.execute("insert into browser(browser, users, date, description) values({0},\'{1}\',\'{2}\',\'{3}\')".format("NULL","0",i,""))
-					content2.append([None,'0',i,''])
-				for row in report.get('data', {}).get('rows', []):
-					dum = []
-					dimensions = row.get('dimensions', [])
-					dateRangeValues = row.get('metrics', [])
-					for header, dimension in zip(dimensionHeaders, dimensions):
-						dum.append(dimension)
-					for values in dateRangeValues:
-						for value in values.get('values'):
-							dum.append(value)
-						dum.append(i)
-						dum.append('')
-					cur.execute("insert into browser(browser, users, date, description) values(\'{0}\',\'{1}\',\'{2}\',\'{3}\')".format(dum[0],dum[1],dum[2],dum[3]))
-					content2.append(dum)
-		else:
-			content2.append(list(result2[0]))
-
-		if len(result3)==0:
-			response3 = get_value_system3(i)
-			for report in response3.get('reports', []):
-				columnHeader = report.get('columnHeader', {})
-				dimensionHeaders = columnHeader.get('dimensions', [])
-				metricHeaders = columnHeader.get('metricHeader', {}).get('metricHeaderEntries', [])
-				if 'rows' not in list(report.get('data', {}).keys()):
-					cur.execute("insert into device(deviceCategory, users, date, description) values({0},\'{1}\',\'{2}\',\'{3}\')".format("NULL","0",i,""))
-					content3.append([None,'0',i,''])
-				for row in report.get('data', {}).get('rows', []):
-					dum = []
-					dimensions = row.get('dimensions', [])
-					dateRangeValues = row.get('metrics', [])
-					for header, dimension in zip(dimensionHeaders, dimensions):
-						dum.append(dimension)
-					for values in dateRangeValues:
-						for value in values.get('values'):
-							dum.append(value)
-						dum.append(i)
-						dum.append('')
-					cur.execute("insert into device(deviceCategory, users, date, description) values(\'{0}\',\'{1}\',\'{2}\',\'{3}\')".format(dum[0],dum[1],dum[2],dum[3]))
-					content3.append(dum)
-		else:
-			content3.append(list(result3[0]))
-
-	conn.commit()
-	cur.close()
-	conn.close()
-
-	dataf1 = pd.DataFrame(content1, columns=column_names_os)
-	dataf2 = pd.DataFrame(content2, columns=column_names_browser)
-	dataf3 = pd.DataFrame(content3, columns=column_names_device)
-	fig1 = go.Scatter(x=dataf1['date'], y=dataf1['operatingSystem'], marker_size = dataf1['users'].astype(int)*10, mode = "markers", name= "Operating System", text = 'Users : '+dataf1['users'])
-	fig2 = go.Scatter(x=dataf2['date'], y=dataf2['browser'],marker_size = dataf2['users'].astype(int)*10, mode = "markers", name = "Browser", text = 'Users : '+dataf2['users'])
-	fig3 = go.Scatter(x=dataf3['date'], y=dataf3['deviceCategory'], marker_size = dataf3['users'].astype(int)*10, mode = "markers", name = "Device Category", text = 'Users : '+dataf3['users'])
+	scale = 10/get_period_days(days)
+	fig1 = dict(type='scatter', x=dataf1['date'].tolist(), y=dataf1['operatingSystem'].tolist(), marker = dict(size = (dataf1['users'].astype(int)*scale).tolist()), mode = "markers", name= "Operating System", text = ('Users : '+dataf1['users'].astype(str)).tolist())
+	fig2 = dict(type='scatter', x=dataf2['date'].tolist(), y=dataf2['browser'].tolist(), marker = dict(size = (dataf2['users'].astype(int)*scale).tolist()), mode = "markers", name = "Browser", text = ('Users : '+dataf2['users'].astype(str)).tolist())
+	fig3 = dict(type='scatter', x=dataf3['date'].tolist(), y=dataf3['deviceCategory'].tolist(), marker = dict(size = (dataf3['users'].astype(int)*scale).tolist()), mode = "markers", name = "Device Category", text = ('Users : '+dataf3['users'].astype(str)).tolist())
 	return fig1, fig2, fig3
 
-def get_value_sessions(date):
-	SCOPES = ['https://www.googleapis.com/auth/analytics.readonly']
-	KEY_FILE_LOCATION = 'YOUR CREDENTIAL FILE LOCATION'
-	VIEW_ID = 'YOUR VIEW ID'
-	credentials = ServiceAccountCredentials.from_json_keyfile_name(KEY_FILE_LOCATION, SCOPES)
-	analytics = build('analyticsreporting', 'v4', credentials=credentials)
-	response = analytics.reports().batchGet(
+def get_value_sessions(date, end_date = None, view = VIEW_ID):
+	analytics = get_analytics()
+	response = execute_ga(analytics.reports().batchGet(
 					body={
 						'reportRequests': [
 						{
-							'viewId': VIEW_ID,
-							'dateRanges': [{'startDate': date, 'endDate': date}],
+							'viewId': view,
+							'dateRanges': [{'startDate': date, 'endDate': end_date or date}],
+							'dimensions': date_dimensions(end_date),
+							'pageSize': 10000,
 							'metrics' : [{'expression':'ga:sessions'},{'expression':'ga:bounceRate'},{'expression':'ga:hits'}]
 						}]
 					}
-				).execute()
+				), 'sessions')
 	return response
 
-def plot_sessions():
-	conn = psycopg2.connect(DATABASE_URL)
-	cur = conn.cursor()
+def plot_sessions(days = 10, view = DEFAULT_VIEW):
+	dataf = load_window('sessions', days, column_names_sessions, callback_fetch(get_value_sessions), view)
 
-	today_date = datetime.today().strftime('%Y-%m-%d')
-	date_list = pd.date_range(end = datetime.today(), periods = 11).to_pydatetime().tolist()
-	date_list.pop()
-	for i in range(len(date_list)):
-		date_list[i] = date_list[i].strftime('%Y-%m-%d')
-	content = []
-	query = "select sessions, bounceRate, hits, date, description from sessions where date = \'{0}\'"
-
-	for i in date_list:
-		cur.execute(query.format(i))
-		result = cur.fetchall()
-		if len(result)==0:
-			response = get_value_sessions(i)
-			for report in response.get('reports', []):
-				columnHeader = report.get('columnHeader', {})
-				dimensionHeaders = columnHeader.get('dimensions', [])
-				metricHeaders = columnHeader.get('metricHeader', {}).get('metricHeaderEntries', [])
-				if 'rows' not in list(report.get('data', {}).keys()):
-					cur.execute("insert into sessions(sessions, bounceRate, hits, date, description) values(\'{0}\',\'{1}\',\'{2}\',\'{3}\',\'{4}\')".format("0","0","0",i,""))
-					content.append(['0','0','0',i,''])
-				for row in report.get('data', {}).get('rows', []):
-					dum = []
-					dimensions = row.get('dimensions', [])
-					dateRangeValues = row.get('metrics', [])
-					for header, dimension in zip(dimensionHeaders, dimensions):
-						dum.append(dimension)
-					for values in dateRangeValues:
-						for value in values.get('values'):
-							dum.append(value)
-						dum.append(i)
-						dum.append('')
-					cur.execute("insert into sessions(sessions, bounceRate, hits, date, description) values(\'{0}\',\'{1}\',\'{2}\',\'{3}\',\'{4}\')".format(dum[0],dum[1],dum[2],dum[3],dum[4]))
-					content.append(dum)
-		else:
-			content.append(list(result[0]))
-	
-	conn.commit()
-	cur.close()
-	conn.close()
-
-	dataf = pd.DataFrame(content, columns=column_names_sessions)
-	dataf['bounceRate'] = (dataf['bounceRate'].astype(float)).map('{:.2f}'.format).astype(float)
-	fig1 = go.Scatter(x=dataf['date'], y=dataf['sessions'], marker_size = dataf['sessions'].astype(int)*0.65, mode = "markers+lines", name= "Sessions")
-	fig2 = go.Scatter(x=dataf['date'], y=dataf['bounceRate'], marker_size = dataf['bounceRate'].astype(int)*0.65, mode = "markers+lines", name = "Bounce Rate")
-	fig3 = go.Scatter(x=dataf['date'], y=dataf['hits'], marker_size = dataf['hits'].astype(int)*0.65, mode = "markers+lines", name = "Hits")
+	scale = 0.65/get_period_days(days)
+	dataf['bounceRate'] = (dataf['bounceRate'].astype(float)).round(2)
+	fig1 = dict(type='scatter', x=dataf['date'].tolist(), y=dataf['sessions'].tolist(), marker = dict(size = (dataf['sessions'].astype(int)*scale).tolist()), mode = "markers+lines", name= "Sessions")
+	fig2 = dict(type='scatter', x=dataf['date'].tolist(), y=dataf['bounceRate'].tolist(), marker = dict(size = (dataf['bounceRate'].astype(int)*0.65).tolist()), mode = "markers+lines", name = "Bounce Rate")
+	fig3 = dict(type='scatter', x=dataf['date'].tolist(), y=dataf['hits'].tolist(), marker = dict(size = (dataf['hits'].astype(int)*scale).tolist()), mode = "markers+lines", name = "Hits")
 	return fig1, fig2, fig3
 
-def get_value_pageviews(date):
-	SCOPES = ['https://www.googleapis.com/auth/analytics.readonly']
-	KEY_FILE_LOCATION = 'YOUR CREDENTIAL FILE LOCATION'
-	VIEW_ID = 'YOUR VIEW ID'
-	credentials = ServiceAccountCredentials.from_json_keyfile_name(KEY_FILE_LOCATION, SCOPES)
-	analytics = build('analyticsreporting', 'v4', credentials=credentials)
-	response = analytics.reports().batchGet(
+def get_value_pageviews(date, end_date = None, view = VIEW_ID):
+	analytics = get_analytics()
+	response = execute_ga(analytics.reports().batchGet(
 					body={
 						'reportRequests': [
 						{
-							'viewId': VIEW_ID,
-							'dateRanges': [{'startDate': date, 'endDate': date}],
+							'viewId': view,
+							'dateRanges': [{'startDate': date, 'endDate': end_date or date}],
+							'dimensions': date_dimensions(end_date),
+							'pageSize': 10000,
 							'metrics' : [{'expression':'ga:pageviews'},{'expression':'ga:pageviewsPerSession'},{'expression':'ga:uniquePageviews'},{'expression':'ga:avgTimeOnPage'}]
 						}]
 					}
-				).execute()
+				), 'pageviews')
 	return response
 
-def plot_pageviews():
-	conn = psycopg2.connect(DATABASE_URL)
-	cur = conn.cursor()
+def plot_pageviews(days = 10, view = DEFAULT_VIEW):
+	dataf = load_window('pageviews', days, column_names_pageviews, callback_fetch(get_value_pageviews), view)
 
-	today_date = datetime.today().strftime('%Y-%m-%d')
-	date_list = pd.date_range(end = datetime.today(), periods = 11).to_pydatetime().tolist()
-	date_list.pop()
-	for i in range(len(date_list)):
-		date_list[i] = date_list[i].strftime('%Y-%m-%d')
-	content = []
-	query = "select pageviews, pageviewsPerSession, uniquePageviews, avgTimeOnPage, date, description from pageviews where date = \'{0}\'"
-
-	for i in date_list:
-		cur.execute(query.format(i))
-		result = cur.fetchall()
-		if len(result)==0:
-			response = get_value_pageviews(i)
-			for report in response.get('reports', []):
-				columnHeader = report.get('columnHeader', {})
-				dimensionHeaders = columnHeader.get('dimensions', [])
-				metricHeaders = columnHeader.get('metricHeader', {}).get('metricHeaderEntries', [])
-				if 'rows' not in list(report.get('data', {}).keys()):
-					cur.execute("insert into pageviews(pageviews, pageviewsPerSession, uniquePageviews, avgTimeOnPage, date, description) values(\'{0}\',\'{1}\',\'{2}\',\'{3}\',\'{4}\',\'{5}\')".format("0","0","0","0",i,""))
-					content.append(['0','0','0','0',i,''])
-				for row in report.get('data', {}).get('rows', []):
-					dum = []
-					dimensions = row.get('dimensions', [])
-					dateRangeValues = row.get('metrics', [])
-					for header, dimension in zip(dimensionHeaders, dimensions):
-						dum.append(dimension)
-					for values in dateRangeValues:
-						for value in values.get('values'):
-							dum.append(value)
-						dum.append(i)
-						dum.append('')
-					cur.execute("insert into pageviews(pageviews, pageviewsPerSession, uniquePageviews, avgTimeOnPage, date, description) values(\'{0}\',\'{1}\',\'{2}\',\'{3}\',\'{4}\',\'{5}\')".format(dum[0],dum[1],dum[2],dum[3],dum[4],dum[5]))
-					content.append(dum)
-		else:
-			content.append(list(result[0]))
-
-	conn.commit()
-	cur.close()
-	conn.close()
-
-	dataf = pd.DataFrame(content, columns=column_names_pageviews)
-	dataf['pageviewsPerSession'] = (dataf['pageviewsPerSession'].astype(float)).map('{:.0f}'.format).astype(float)
-	dataf['avgTimeOnPage'] = (dataf['avgTimeOnPage'].astype(float)).map('{:.0f}'.format).astype(float)
+	dataf['pageviewsPerSession'] = (dataf['pageviewsPerSession'].astype(float)).round(0)
+	dataf['avgTimeOnPage'] = (dataf['avgTimeOnPage'].astype(float)).round(0)
 	dataf['pageviews'] = dataf['pageviews'].astype(float)
 	dataf['uniquePageviews'] = dataf['uniquePageviews'].astype(float)
 
-	fig1 = go.Scatter(x=dataf['date'], y=dataf['pageviewsPerSession'], marker=dict(color="ghostwhite", size=12), mode="markers", name = "Pageviews Per Session", opacity=0.7)
-	fig2 = go.Scatter(x=dataf['date'], y=dataf['avgTimeOnPage'], marker=dict(color="sandybrown", size=12), mode="markers", name = "Avg. Time On Page", opacity=0.7)
-	fig3 = go.Scatter(x=dataf['date'], y=dataf['pageviews'], marker=dict(color="hotpink", size=12), mode="markers", name = "Pageviews", opacity=0.85)
-	fig4 = go.Scatter(x=dataf['date'], y=dataf['uniquePageviews'], marker=dict(color="dodgerblue", size=12), mode="markers", name = "Unique Pageviews", opacity=0.7)
+	fig1 = dict(type='scatter', x=dataf['date'].tolist(), y=dataf['pageviewsPerSession'].tolist(), marker=dict(color="ghostwhite", size=12), mode="markers", name = "Pageviews Per Session", opacity=0.7)
+	fig2 = dict(type='scatter', x=dataf['date'].tolist(), y=dataf['avgTimeOnPage'].tolist(), marker=dict(color="sandybrown", size=12), mode="markers", name = "Avg. Time On Page", opacity=0.7)
+	fig3 = dict(type='scatter', x=dataf['date'].tolist(), y=dataf['pageviews'].tolist(), marker=dict(color="hotpink", size=12), mode="markers", name = "Pageviews", opacity=0.85)
+	fig4 = dict(type='scatter', x=dataf['date'].tolist(), y=dataf['uniquePageviews'].tolist(), marker=dict(color="dodgerblue", size=12), mode="markers", name = "Unique Pageviews", opacity=0.7)
 
 	return fig1, fig2, fig3, fig4
 
-def get_value_users():
-	SCOPES = ['https://www.googleapis.com/auth/analytics.readonly']
-	KEY_FILE_LOCATION = 'YOUR CREDENTIAL FILE LOCATION'
-	VIEW_ID = 'YOUR VIEW ID'
-	credentials = ServiceAccountCredentials.from_json_keyfile_name(KEY_FILE_LOCATION, SCOPES)
-	analytics = build('analyticsreporting', 'v4', credentials=credentials)
-	response = analytics.reports().batchGet(
+@cached_report(REPORT_TTL)
+def get_value_users(view = VIEW_ID):
+	analytics = get_analytics()
+	response = execute_ga(analytics.reports().batchGet(
 					body={
 						'reportRequests': [
 						{
-							'viewId': VIEW_ID,
+							'viewId': view,
 							'dateRanges': [{'startDate': '2020-05-10', 'endDate': 'today'}],
 							'dimensions' : [{'name':'ga:userType'}],
 							'metrics' : [{'expression':'ga:users'}]
 						}]
 					}
-				).execute()
+				), 'users')
 	return response
 
-def plot_users():
-	content = []
-	response = get_value_users()
-	for report in response.get('reports', []):
-		columnHeader = report.get('columnHeader', {})
-		dimensionHeaders = columnHeader.get('dimensions', [])
-		metricHeaders = columnHeader.get('metricHeader', {}).get('metricHeaderEntries', [])
-		if 'rows' not in list(report.get('data', {}).keys()):
-			content.append(['0','0'])
-		for row in report.get('data', {}).get('rows', []):
-			dum = []
-			dimensions = row.get('dimensions', [])
-			dateRangeValues = row.get('metrics', [])
-			for header, dimension in zip(dimensionHeaders, dimensions):
-				dum.append(dimension)
-			for values in dateRangeValues:
-				for value in values.get('values'):
-					dum.append(value)
-			content.append(dum)
-
-	dataf = pd.DataFrame(content, columns=column_names_users)
-	fig = go.Pie(labels=dataf['visitorType'], values=dataf['users'], hole = 0.3, name ="")
+def plot_users(view = DEFAULT_VIEW):
+	frames = [parse_response(i, column_names_users) for i in async_access.gather(gather_views('ga', get_value_users, view))[0]]
+	dataf = pd.concat(frames, ignore_index=True)
+	if len(frames) > 1:
+		dataf = dataf.groupby('visitorType', as_index=False, sort=False)['users'].sum()
+	if len(dataf) == 0:
+		dataf = pd.DataFrame([['0', 0]], columns=column_names_users)
+	fig = dict(type='pie', labels=dataf['visitorType'].tolist(), values=dataf['users'].tolist(), hole = 0.3, name ="")
 	return fig
 
-def get_value_overall():
-	SCOPES = ['https://www.googleapis.com/auth/analytics.readonly']
-	KEY_FILE_LOCATION = 'YOUR CREDENTIAL FILE LOCATION'
-	VIEW_ID = 'YOUR VIEW ID'
-	credentials = ServiceAccountCredentials.from_json_keyfile_name(KEY_FILE_LOCATION, SCOPES)
-	analytics = build('analyticsreporting', 'v4', credentials=credentials)
-	response = analytics.reports().batchGet(
+@cached_report(REPORT_TTL)
+def get_value_overall(view = VIEW_ID):
+	analytics = get_analytics()
+	response = execute_ga(analytics.reports().batchGet(
 					body={
 						'reportRequests': [
 						{
-							'viewId': VIEW_ID,
+							'viewId': view,
 							'dateRanges': [{'startDate': '2020-05-10', 'endDate': 'today'}],
 							'metrics' : [{'expression':'ga:users'},{'expression':'ga:sessions'},{'expression':'ga:avgSessionDuration'},{'expression':'ga:pageviews'},{'expression':'ga:pageviewsPerSession'},{'expression':'ga:bounceRate'},{'expression':'ga:avgTimeOnPage'},{'expression':'ga:hits'},{'expression':'ga:uniquePageviews'}]
 						}]
 					}
-				).execute()
+				), 'overall')
 	return response
 
-def plot_overall():
-	content = []
-	response = get_value_overall()
-	for report in response.get('reports', []):
-		columnHeader = report.get('columnHeader', {})
-		dimensionHeaders = columnHeader.get('dimensions', [])
-		metricHeaders = columnHeader.get('metricHeader', {}).get('metricHeaderEntries', [])
-		for row in report.get('data', {}).get('rows', []):
-			dum = []
-			dimensions = row.get('dimensions', [])
-			dateRangeValues = row.get('metrics', [])
-			for header, dimension in zip(dimensionHeaders, dimensions):
-				dum.append(dimension)
-			for values in dateRangeValues:
-				for value in values.get('values'):
-					dum.append(value)
-			content.append(dum)
-
-	content[0][2] = '{:.2f}'.format(float(content[0][2]))
-	content[0][4] = '{:.2f}'.format(float(content[0][4]))
-	content[0][5] = '{:.2f}'.format(float(content[0][5]))
-	content[0][6] = '{:.2f}'.format(float(content[0][6]))
-
-	fig =  go.Table(header = dict(values=['Attributes', 'Value'], fill_color = "#4d004c", font=dict(color='white', size=12.5), height = 21),cells = dict(values=[column_names_overall, content[0]], fill_color = [['#f2e5ff','#ffffff','#f2e5ff','#ffffff','#f2e5ff','#ffffff','#f2e5ff','#ffffff','#f2e5ff']*2], font = dict(size = 12, color = "black"), height = 21))
+# Totals over several views: counts add up and averages are weighted by the sessions or pageviews they were taken over.
+def merge_overall(dataf):
+	total = dataf.sum()
+	ratio = lambda a, b: a/b if b else 0
+	sessions, pageviews = total['Sessions'], total['Pageviews']
+	total['Avg. Session Duration'] = ratio((dataf['Avg. Session Duration']*dataf['Sessions']).sum(), sessions)
+	total['Pageviews Per Session'] = ratio(pageviews, sessions)
+	total['Bounce Rate'] = ratio((dataf['Bounce Rate']*dataf['Sessions']).sum(), sessions)
+	total['Avg. Time On Page'] = ratio((dataf['Avg. Time On Page']*dataf['Pageviews']).sum(), pageviews)
+	return [int(total[i]) if i in ('Users', 'Sessions', 'Pageviews', 'Hits', 'Unique Pageviews') else total[i] for i in column_names_overall]
+
+def plot_overall(view = DEFAULT_VIEW):
+	frames = [parse_response(i, column_names_overall) for i in async_access.gather(gather_views('ga', get_value_overall, view))[0]]
+	if len(frames) > 1:
+		content = merge_overall(pd.concat(frames, ignore_index=True))
+	else:
+		content = frames[0].iloc[0].tolist()
+	for i in (2, 4, 5, 6):
+		content[i] = '{:.2f}'.format(content[i])
+
+	fig = dict(type='table', header = dict(values=['Attributes', 'Value'], fill_color = "#4d004c", font=dict(color='white', size=12.5), height = 21),cells = dict(values=[column_names_overall, content], fill_color = [['#f2e5ff','#ffffff','#f2e5ff','#ffffff','#f2e5ff','#ffffff','#f2e5ff','#ffffff','#f2e5ff']*2], font = dict(size = 12, color = "black"), height = 21))
 	return fig
 
-def get_plot_general():
-	SCOPES = ['https://www.googleapis.com/auth/analytics.readonly']
-	KEY_FILE_LOCATION = 'YOUR CREDENTIAL FILE LOCATION'
-	VIEW_ID = 'YOUR VIEW ID'
-	credentials = ServiceAccountCredentials.from_json_keyfile_name(KEY_FILE_LOCATION, SCOPES)
-	analytics = build('analyticsreporting', 'v4', credentials=credentials)
-	response = analytics.reports().batchGet(
-					body={
-						'reportRequests': [
-						{
-						'viewId': VIEW_ID,
-						'dateRanges': [{'startDate': '2020-05-10', 'endDate': 'today'}],
-						'dimensions': [{'name': 'ga:country'},{'name': 'ga:region'},{'name': 'ga:city'},{'name': 'ga:longitude'},{'name': 'ga:latitude'}],
-						'metrics': [{'expression': 'ga:newUsers'},{'expression': 'ga:sessions'},{'expression': 'ga:UniquePageviews'},{'expression':'ga:bounceRate'},{'expression':'ga:avgSessionDuration'},{'expression': 'ga:hits'}],
-						}]
-					}
-				).execute()
-	content = []
-	for report in response.get('reports', []):
-		columnHeader = report.get('columnHeader', {})
-		dimensionHeaders = columnHeader.get('dimensions', [])
-		metricHeaders = columnHeader.get('metricHeader', {}).get('metricHeaderEntries', [])
-		for row in report.get('data', {}).get('rows', []):
-			dum = []
-			dimensions = row.get('dimensions', [])
-			dateRangeValues = row.get('metrics', [])
-			for header, dimension in zip(dimensionHeaders, dimensions):
-				dum.append(dimension)
-			for values in dateRangeValues:
-				for value in values.get('values'):
-					dum.append(value)
-			dum.append('')
-			content.append(dum)
-	dataf = pd.DataFrame(content, columns=column_names_overview_geo)
-	dataf['text'] = dataf['city']+','+dataf['region']+','+dataf['country']+'<br>'+'Users : '+dataf['users']+'<br>'+'Sessions : '+dataf['sessions']+'<br>'+'Unique Pageviews : '+dataf['UniquePageviews']+'<br>'+'Bounce Rate : '+dataf['bounceRate']+'<br>'+'Avg. Session Duration : '+dataf['avgSessionDuration']+'<br>'+'Hits : '+dataf['hits']
-	return get_plot(dataf, 'sessions')
+@cached_report(REPORT_TTL)
+def get_value_general(view = VIEW_ID):
+	return read_report({
+		'viewId': view,
+		'dateRanges': [{'startDate': '2020-05-10', 'endDate': 'today'}],
+		'dimensions': [{'name': 'ga:country'},{'name': 'ga:region'},{'name': 'ga:city'},{'name': 'ga:longitude'},{'name': 'ga:latitude'}],
+		'metrics': [{'expression': 'ga:newUsers'},{'expression': 'ga:sessions'},{'expression': 'ga:UniquePageviews'},{'expression':'ga:bounceRate'},{'expression':'ga:avgSessionDuration'},{'expression': 'ga:hits'}],
+	}, column_names_overview_geo, name = 'general')
+
+# A cached report of every selected view, fetched concurrently and stacked, with the versions of all of them as its version.
+def get_views_versioned(report, view, *args):
+	results = async_access.gather(gather_views('ga', report.versioned, view, *args))[0]
+	versions = tuple(i[1] for i in results)
+	if len(results) == 1:
+		return results[0]
+	return pd.concat([i[0] for i in results], ignore_index=True), None if None in versions else versions
+
+def get_plot_general(cell = None, view = DEFAULT_VIEW):
+	dataf, version = get_views_versioned(get_value_general, view)
+	return cached_figure(('general', view, cell), version, lambda: plot_general(dataf.copy(), cell))
+
+def plot_general(dataf, cell = None):
+	dataf['text'] = dataf['city']+','+dataf['region']+','+dataf['country']+'<br>'+'Users : '+dataf['users'].astype(str)+'<br>'+'Sessions : '+dataf['sessions'].astype(str)+'<br>'+'Unique Pageviews : '+dataf['UniquePageviews'].astype(str)+'<br>'+'Bounce Rate : '+dataf['bounceRate'].astype(str)+'<br>'+'Avg. Session Duration : '+dataf['avgSessionDuration'].astype(str)+'<br>'+'Hits : '+dataf['hits'].astype(str)
+	return get_plot(decimate_geo(dataf, cell), 'sessions')
 
-@app.callback(Output('graph-2','children'),[Input('radio-button-3','value')])
-def update_general_or_traffic_source(selected_option):
+@app.callback(Output('graph-2','children'),[Input('radio-button-3','value'), Input('view-select','value')])
+@timed
+def update_general_or_traffic_source(selected_option, view):
+	check_view(view)
 	if selected_option == "GEN":
 		return [
 			dcc.Graph(
 				id='overview-graph-1',
-				figure=get_plot_general(),
+				figure=get_plot_general(view = view),
 				style={'float':'left'}
 			),
 		]
@@ -801,7 +2505,7 @@ def update_general_or_traffic_source(selected_option):
 		return [
 			dcc.Graph(
 				id='overview-graph-2',
-				figure=update_traffic_graph("SRC"),
+				figure=update_traffic_graph("SRC", view = view),
 				style={'float':'left'}
 			),
 		]
@@ -809,81 +2513,64 @@ def update_general_or_traffic_source(selected_option):
 		return [
 			dcc.Graph(
 				id='overview-graph-3',
-				figure=update_traffic_graph("MDM"),
+				figure=update_traffic_graph("MDM", view = view),
 				style={'float':'left'}
 			),
 		]
 
-def update_traffic_graph(value):
-	SCOPES = ['https://www.googleapis.com/auth/analytics.readonly']
-	KEY_FILE_LOCATION = 'YOUR CREDENTIAL FILE LOCATION'
-	VIEW_ID = 'YOUR VIEW ID'
-	credentials = ServiceAccountCredentials.from_json_keyfile_name(KEY_FILE_LOCATION, SCOPES)
-	analytics = build('analyticsreporting', 'v4', credentials=credentials)
+@cached_report(REPORT_TTL)
+def get_value_traffic(dimension, columns, view = VIEW_ID):
+	return read_report({
+		'viewId': view,
+		'dateRanges': [{'startDate': '2020-05-10', 'endDate': 'today'}],
+		'dimensions': [{'name': 'ga:country'},{'name': 'ga:region'},{'name': 'ga:city'},{'name': 'ga:longitude'},{'name': 'ga:latitude'},{'name': dimension}],
+		'metrics': [{'expression': 'ga:newUsers'}],
+	}, columns, name = dimension[3:])
+
+def update_traffic_graph(value, cell = None, view = DEFAULT_VIEW):
 	if value=="SRC":
-		response = analytics.reports().batchGet(
-						body={
-							'reportRequests': [
-							{
-							'viewId': VIEW_ID,
-							'dateRanges': [{'startDate': '2020-05-10', 'endDate': 'today'}],
-							'dimensions': [{'name': 'ga:country'},{'name': 'ga:region'},{'name': 'ga:city'},{'name': 'ga:longitude'},{'name': 'ga:latitude'},{'name': 'ga:source'}],
-							'metrics': [{'expression': 'ga:newUsers'}],
-							}]
-						}
-					).execute()
-		content = []
-		for report in response.get('reports', []):
-			columnHeader = report.get('columnHeader', {})
-			dimensionHeaders = columnHeader.get('dimensions', [])
-			metricHeaders = columnHeader.get('metricHeader', {}).get('metricHeaderEntries', [])
-			for row in report.get('data', {}).get('rows', []):
-				dum = []
-				dimensions = row.get('dimensions', [])
-				dateRangeValues = row.get('metrics', [])
-				for header, dimension in zip(dimensionHeaders, dimensions):
-					dum.append(dimension)
-				for values in dateRangeValues:
-					for value in values.get('values'):
-						dum.append(value)
-				dum.append('')
-				content.append(dum)
-		dataf = pd.DataFrame(content, columns=column_names_source_geo)
-		dataf['text'] = dataf['city']+','+dataf['region']+','+dataf['country']+'<br>'+'Users : '+dataf['users']+'<br>'+'Source : '+dataf['source']
-		return get_plot(dataf, "latitude")
+		dataf, version = get_views_versioned(get_value_traffic, view, 'ga:source', tuple(column_names_source_geo))
 	elif value=="MDM":
-		response = analytics.reports().batchGet(
-						body={
-							'reportRequests': [
-							{
-							'viewId': VIEW_ID,
-							'dateRanges': [{'startDate': '2020-05-10', 'endDate': 'today'}],
-							'dimensions': [{'name': 'ga:country'},{'name': 'ga:region'},{'name': 'ga:city'},{'name': 'ga:longitude'},{'name': 'ga:latitude'},{'name': 'ga:medium'}],
-							'metrics': [{'expression': 'ga:newUsers'}],
-							}]
-						}
-					).execute()
-		content = []
-		for report in response.get('reports', []):
-			columnHeader = report.get('columnHeader', {})
-			dimensionHeaders = columnHeader.get('dimensions', [])
-			metricHeaders = columnHeader.get('metricHeader', {}).get('metricHeaderEntries', [])
-			for row in report.get('data', {}).get('rows', []):
-				dum = []
-				dimensions = row.get('dimensions', [])
-				dateRangeValues = row.get('metrics', [])
-				for header, dimension in zip(dimensionHeaders, dimensions):
-					dum.append(dimension)
-				for values in dateRangeValues:
-					for value in values.get('values'):
-						dum.append(value)
-				dum.append('')
-				content.append(dum)
-		dataf = pd.DataFrame(content, columns=column_names_medium_geo)
-		dataf['text'] = dataf['city']+','+dataf['region']+','+dataf['country']+'<br>'+'Users : '+dataf['users']+'<br>'+'Medium : '+dataf['medium']
-		return get_plot(dataf, "longitude")
+		dataf, version = get_views_versioned(get_value_traffic, view, 'ga:medium', tuple(column_names_medium_geo))
+	return cached_figure((value, view, cell), version, lambda: plot_traffic(value, dataf.copy(), cell))
+
+def plot_traffic(value, dataf, cell = None):
+	if value=="SRC":
+		dataf['text'] = dataf['city']+','+dataf['region']+','+dataf['country']+'<br>'+'Users : '+dataf['users'].astype(str)+'<br>'+'Source : '+dataf['source']
+		return get_plot(decimate_geo(dataf, cell), "latitude")
+	elif value=="MDM":
+		dataf['text'] = dataf['city']+','+dataf['region']+','+dataf['country']+'<br>'+'Users : '+dataf['users'].astype(str)+'<br>'+'Medium : '+dataf['medium']
+		return get_plot(decimate_geo(dataf, cell), "longitude")
+
+# Clicking a cluster shows every place inside its cell; clicking anywhere on that detail view goes back to the clusters.
+def get_drill_cell(clickData):
+	if clickData is None:
+		raise PreventUpdate
+	cell = clickData['points'][0].get('customdata')
+	if cell is None:
+		return None
+	return tuple(cell)
+
+@app.callback(Output('overview-graph-1','figure'),[Input('overview-graph-1','clickData')],[State('view-select','value')])
+@timed
+def drill_general(clickData, view):
+	check_view(view)
+	return get_plot_general(get_drill_cell(clickData), view)
+
+@app.callback(Output('overview-graph-2','figure'),[Input('overview-graph-2','clickData')],[State('view-select','value')])
+@timed
+def drill_source(clickData, view):
+	check_view(view)
+	return update_traffic_graph("SRC", get_drill_cell(clickData), view)
+
+@app.callback(Output('overview-graph-3','figure'),[Input('overview-graph-3','clickData')],[State('view-select','value')])
+@timed
+def drill_medium(clickData, view):
+	check_view(view)
+	return update_traffic_graph("MDM", get_drill_cell(clickData), view)
 
 @app.callback([Output('button-1','children'), Output('graph-1','children')],[Input('radio-button-2','value')])
+@timed
 def update_manually_or_go_live(selected_option):
 	if selected_option == "GL":
 		return [
@@ -891,13 +2578,15 @@ def update_manually_or_go_live(selected_option):
 			[
 				dcc.Graph(
 					id='live-graph-1',
-					figure=get_plot(df, "users"),
+					figure=get_plot(pd.DataFrame(columns=column_names_real_time_geo), "users"),
 					style={'float':'left'}
 				),
 				dcc.Interval(
 					id='graph-update',
-					interval=1000*100
-				)
+					interval=1000*REALTIME_POLL_INTERVAL
+				),
+				dcc.Store(id='live-delta'),
+				dcc.Store(id='live-version')
 			]
 		]
 	elif selected_option == "UM":
@@ -908,39 +2597,400 @@ def update_manually_or_go_live(selected_option):
 			[
 				dcc.Graph(
 					id='live-graph-2',
-					figure=get_plot(df, "users"),
+					figure=get_plot(pd.DataFrame(columns=column_names_real_time_geo), "users"),
 					style={'float':'left'}
 				)
 			]
 		]
 
-@app.callback(Output('live-graph-1','figure'),[Input('graph-update','n_intervals')])
-def update_live_graph(self):
-	scope = 'https://www.googleapis.com/auth/analytics.readonly'
-	key_file_location = 'YOUR CREDENTIAL FILE LOCATION'
-	service = get_service(api_name='analytics', api_version='v3', scopes=[scope], key_file_location=key_file_location)
-	profile_id = get_first_profile_id(service)
-	results = get_results(service, profile_id)
-	rows = results.get('rows',[])
+# Go Live only ships the marker arrays of a new snapshot; assets/clientside.js patches them into the figure already on the page.
+@app.callback([Output('live-delta','data'), Output('live-version','data')],[Input('graph-update','n_intervals')],[State('live-version','data'), State('view-select','value')])
+@timed
+def update_live_markers(n_intervals, version, view):
+	check_view(view)
+	fetched_at, rows = realtime_poller.snapshot(view = view)
+	if [fetched_at, view] == version:
+		return dash.no_update, dash.no_update
 	for row in rows:
 		row.append('')
 	dataf = pd.DataFrame(rows,columns=column_names_real_time_geo)
 	dataf['text'] = dataf['city']+'<br>'+"Users : "+dataf['users']
-	return get_plot(dataf, "longitude")
-
-@app.callback(Output('live-graph-2','figure'),[Input('clicked-button-1','n_clicks')])
-def update_live_graph(n_clicks):
-	scope = 'https://www.googleapis.com/auth/analytics.readonly'
-	key_file_location = 'YOUR CREDENTIAL FILE LOCATION'
-	service = get_service(api_name='analytics', api_version='v3', scopes=[scope], key_file_location=key_file_location)
-	profile_id = get_first_profile_id(service)
-	results = get_results(service, profile_id)
-	rows = results.get('rows',[])
+	return get_markers(dataf, "longitude"), [fetched_at, view]
+
+app.clientside_callback(
+	ClientsideFunction(namespace='live', function_name='apply_delta'),
+	Output('live-graph-1','figure'),
+	[Input('live-delta','data')],
+	[State('live-graph-1','figure')]
+)
+
+@app.callback(Output('live-graph-2','figure'),[Input('clicked-button-1','n_clicks')],[State('view-select','value')])
+@timed
+def update_live_graph(n_clicks, view):
+	check_view(view)
+	rows = realtime_poller.latest(max_age = REALTIME_MIN_REFRESH, view = view)
 	for row in rows:
 		row.append('')
 	dataf = pd.DataFrame(rows,columns=column_names_real_time_geo)
 	dataf['text'] = dataf['city']+'<br>'+"Users : "+dataf['users']
 	return get_plot(dataf, "latitude")
 
+# What the overview was built from: the last day of the window, plus the last successful ingestion when callbacks only read.
+def get_data_version():
+	if INGEST_MODE == 'inline':
+		return get_date_list(1)[0]
+	try:
+		last_success = async_access.run_call('db', read_last_success)
+	except Exception:
+		logger.exception('Could not read the data version')
+		return None
+	return get_date_list(1)[0], str(last_success)
+
+def read_last_success():
+	with db_pool.connection() as conn:
+		cur = conn.cursor()
+
+		ensure_ingest_status(cur)
+		cur.execute("select max(last_success) from ingest_status")
+		last_success = cur.fetchone()[0]
+
+		cur.close()
+	return last_success
+
+def callback_fetch(fetch):
+	if INGEST_MODE == 'inline':
+		return fetch
+	return None
+
+def get_ingest_tables():
+	return [
+		('bandwidth', get_value_bandwidth),
+		('os', get_value_system1),
+		('browser', get_value_system2),
+		('device', get_value_system3),
+		('sessions', get_value_sessions),
+		('pageviews', get_value_pageviews)
+	]
+
+ingest_status_ready = False
+ingest_status_lock = threading.Lock()
+
+def ensure_ingest_status(cur):
+	global ingest_status_ready
+	with ingest_status_lock:
+		if ingest_status_ready:
+			return
+		cur.execute("create table if not exists ingest_status(table_name text primary key, last_attempt timestamp, last_success timestamp, last_error text, latest_date text, rows_ingested integer)")
+		cur.connection.commit()
+		ingest_status_ready = True
+
+def record_ingest(cur, table, latest_date = None, rows = 0, error = None):
+	ensure_ingest_status(cur)
+	if error is None:
+		cur.execute("insert into ingest_status(table_name, last_attempt, last_success, last_error, latest_date, rows_ingested) values(%s, now(), now(), null, %s, %s) "
+			"on conflict (table_name) do update set last_attempt = excluded.last_attempt, last_success = excluded.last_success, last_error = null, latest_date = excluded.latest_date, rows_ingested = excluded.rows_ingested",
+			(table, latest_date, rows))
+	else:
+		cur.execute("insert into ingest_status(table_name, last_attempt, last_error) values(%s, now(), %s) "
+			"on conflict (table_name) do update set last_attempt = excluded.last_attempt, last_error = excluded.last_error",
+			(table, error))
+
+# Fills the days of the window that are missing from `table`. The transaction-scoped advisory lock keeps several workers
+# (or a worker and the ingest process) from fetching the same table at once.
+def ingest_table(table, fetch, date_list, view = VIEW_ID):
+	name = get_table_name(table, view)
+	with db_pool.connection() as conn:
+		cur = conn.cursor()
+
+		ensure_ingest_status(cur)
+		ensure_date_indexes(cur, view)
+		ensure_rollups(cur, view)
+		cur.execute("select pg_try_advisory_xact_lock(%s)", (zlib.crc32(('ingest:' + name).encode('utf-8')),))
+		if not cur.fetchone()[0]:
+			conn.rollback()
+			cur.close()
+			return None
+		found, missing = read_time_series(cur, table, date_list, view)
+		stored = []
+		fetched = fetch_time_series(cur, table, missing, functools.partial(fetch, view = view), view, stored)
+		rows = sum(len(i) for i in fetched.values())
+		record_ingest(cur, name, date_list[-1], rows)
+
+		conn.commit()
+		cur.close()
+	write_stored(stored)
+	fill_store(table, found, view)
+	return rows
+
+def record_ingest_failure(table, error):
+	try:
+		with db_pool.connection() as conn:
+			cur = conn.cursor()
+			record_ingest(cur, table, error = error)
+			conn.commit()
+			cur.close()
+	except Exception:
+		logger.exception('Could not record ingestion failure of %s', table)
+
+class IngestScheduler:
+	def __init__(self, interval, retries, backoff):
+		self.interval = interval
+		self.retries = retries
+		self.backoff = backoff
+		self.stopped = threading.Event()
+		self.thread = None
+
+	def run_once(self):
+		date_list = get_date_list(max(i for i in OVERVIEW_WINDOWS if get_granularity(i) == 'daily'))
+		map_views(lambda view: self.ingest_view(view, date_list), ALL_VIEWS)
+
+	# Views are ingested concurrently, the tables of one view one after another.
+	def ingest_view(self, view, date_list):
+		for table, fetch in get_ingest_tables():
+			if not self.ingest(table, fetch, date_list, view):
+				return
+
+	# False when the scheduler was stopped while backing off.
+	def ingest(self, table, fetch, date_list, view):
+		name = get_table_name(table, view)
+		for attempt in range(self.retries + 1):
+			try:
+				rows = ingest_table(table, fetch, date_list, view)
+				logger.info('Ingested %s rows into %s', rows, name)
+				return True
+			except Exception as e:
+				logger.exception('Ingestion of %s failed (attempt %s of %s)', name, attempt + 1, self.retries + 1)
+				record_ingest_failure(name, repr(e))
+				if self.stopped.wait(self.backoff * 2**attempt):
+					return False
+		return True
+
+	def run_forever(self):
+		while not self.stopped.is_set():
+			self.run_once()
+			self.stopped.wait(self.interval)
+
+	def start(self):
+		if self.thread is None:
+			# The thread needs pandas straight away; importing it here keeps a request from finding it half imported.
+			load_modules(np, pd)
+			self.thread = threading.Thread(target=self.run_forever, name='ingest', daemon=True)
+			self.thread.start()
+
+	def stop(self):
+		self.stopped.set()
+
+ingest_scheduler = IngestScheduler(INGEST_INTERVAL, INGEST_RETRIES, INGEST_BACKOFF)
+
+BACKFILL_CHUNK_DAYS = int(os.environ.get('BACKFILL_CHUNK_DAYS', '31'))
+BACKFILL_WORKERS = int(os.environ.get('BACKFILL_WORKERS', '4'))
+
+backfill_checkpoints_ready = False
+backfill_checkpoints_lock = threading.Lock()
+
+def ensure_backfill_checkpoints(cur):
+	global backfill_checkpoints_ready
+	with backfill_checkpoints_lock:
+		if backfill_checkpoints_ready:
+			return
+		cur.execute("create table if not exists backfill_checkpoints(table_name text, start_date text, end_date text, rows_ingested integer, finished timestamp, primary key (table_name, start_date, end_date))")
+		cur.connection.commit()
+		backfill_checkpoints_ready = True
+
+def get_date_range(start, end):
+	return [i.strftime('%Y-%m-%d') for i in pd.date_range(start = start, end = end).to_pydatetime()]
+
+# Consecutive [start, end] spans of `chunk_days` days, newest first so recent history is usable soonest.
+def get_backfill_chunks(start, end, chunk_days):
+	date_list = get_date_range(start, end)
+	chunks = [(date_list[i], date_list[min(i + chunk_days, len(date_list)) - 1]) for i in range(0, len(date_list), chunk_days)]
+	return chunks[::-1]
+
+# One GA request for the whole chunk. GA cuts a response off at the page size, so a chunk that came back with a next page
+# is fetched again as two halves.
+def fetch_chunk(table, fetch, date_list, view = VIEW_ID):
+	response = fetch(date_list[0], date_list[-1], view = view)
+	if len(date_list) > 1 and any(i.get('nextPageToken') for i in response.get('reports', [])):
+		half = len(date_list)//2
+		fetched = fetch_chunk(table, fetch, date_list[:half], view)
+		fetched.update(fetch_chunk(table, fetch, date_list[half:], view))
+		return fetched
+	return get_rows_by_date(response, table, date_list)
+
+# The chunk is fetched before a connection is taken. Under the table's ingest lock only the days still missing are stored,
+# so the scheduler or an earlier run are never duplicated, and the checkpoint is committed in the same transaction.
+def backfill_chunk(table, fetch, start, end, view = VIEW_ID):
+	name = get_table_name(table, view)
+	date_list = get_date_range(start, end)
+	fetched = fetch_chunk(table, fetch, date_list, view)
+	with db_pool.connection() as conn:
+		cur = conn.cursor()
+
+		ensure_backfill_checkpoints(cur)
+		ensure_date_indexes(cur, view)
+		ensure_rollups(cur, view)
+		cur.execute("select pg_advisory_xact_lock(%s)", (zlib.crc32(('ingest:' + name).encode('utf-8')),))
+		found, missing = read_time_series(cur, table, date_list, view)
+		rows = [row for i in missing for row in fetched[i]]
+		stored = []
+		store_time_series(cur, table, rows, view, stored)
+		cur.execute("insert into backfill_checkpoints(table_name, start_date, end_date, rows_ingested, finished) values(%s, %s, %s, %s, now()) on conflict do nothing", (name, start, end, len(rows)))
+
+		conn.commit()
+		cur.close()
+	write_stored(stored)
+	fill_store(table, found, view)
+	return len(rows)
+
+def get_backfill_checkpoints(names, restart = False):
+	with db_pool.connection() as conn:
+		cur = conn.cursor()
+
+		ensure_backfill_checkpoints(cur)
+		if restart:
+			cur.execute("delete from backfill_checkpoints where table_name in ({0})".format(','.join(['%s']*len(names))), list(names))
+		cur.execute("select table_name, start_date, end_date from backfill_checkpoints")
+		finished = set(tuple(i) for i in cur.fetchall())
+
+		conn.commit()
+		cur.close()
+	return finished
+
+# Loads the ingested tables of every view from `start` up to yesterday, in chunks of `chunk_days` days fetched by `workers`
+# threads. Chunks checkpointed by an earlier run are skipped, so an interrupted backfill picks up where it stopped; `restart`
+# forgets the checkpoints, which only costs GA requests since stored days are kept. Today is still changing and is left to
+# the scheduler. Returns the chunks that failed.
+def backfill(start = HISTORY_START, chunk_days = BACKFILL_CHUNK_DAYS, workers = BACKFILL_WORKERS, views = None, tables = None, restart = False):
+	end = get_date_list(1)[0]
+	views = views or VIEW_IDS
+	ingest_tables = [i for i in get_ingest_tables() if tables is None or i[0] in tables]
+	chunks = get_backfill_chunks(start, end, chunk_days)
+	finished = get_backfill_checkpoints([get_table_name(table, view) for view in views for table, fetch in ingest_tables], restart)
+	jobs = [(table, fetch, chunk_start, chunk_end, view) for chunk_start, chunk_end in chunks for view in views for table, fetch in ingest_tables
+		if (get_table_name(table, view), chunk_start, chunk_end) not in finished]
+	logger.info('Backfilling %s chunks of %s days from %s to %s, %s already done', len(jobs), chunk_days, start, end, len(chunks)*len(views)*len(ingest_tables) - len(jobs))
+	rows = {}
+	failed = []
+	with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='backfill') as executor:
+		futures = dict((executor.submit(backfill_chunk, *job), job) for job in jobs)
+		for future in as_completed(futures):
+			table, fetch, chunk_start, chunk_end, view = futures[future]
+			name = get_table_name(table, view)
+			try:
+				rows[name] = rows.get(name, 0) + future.result()
+				logger.info('Backfilled %s from %s to %s', name, chunk_start, chunk_end)
+			except Exception as e:
+				logger.exception('Backfill of %s from %s to %s failed', name, chunk_start, chunk_end)
+				record_ingest_failure(name, repr(e))
+				failed.append((name, chunk_start, chunk_end))
+	# Tables that are complete now count as ingested, which also moves the data version the dashboards cache by.
+	with db_pool.connection() as conn:
+		cur = conn.cursor()
+
+		for name in rows:
+			if not any(i[0] == name for i in failed):
+				record_ingest(cur, name, end, rows[name])
+
+		conn.commit()
+		cur.close()
+	logger.info('Backfilled %s rows, %s chunks failed', sum(rows.values()), len(failed))
+	return failed
+
+def backfill_main(argv):
+	parser = argparse.ArgumentParser(prog='app.py backfill', description='Load the history of the ingested tables from Google Analytics.')
+	parser.add_argument('--start', default=HISTORY_START, help='first day to load (default %(default)s)')
+	parser.add_argument('--chunk-days', type=int, default=BACKFILL_CHUNK_DAYS, help='days per GA request (default %(default)s)')
+	parser.add_argument('--workers', type=int, default=BACKFILL_WORKERS, help='chunks fetched at once (default %(default)s)')
+	parser.add_argument('--view', action='append', dest='views', help='view to load, may be repeated (default: every view in VIEW_IDS)')
+	parser.add_argument('--table', action='append', dest='tables', choices=list(time_series_tables), help='table to load, may be repeated (default: all)')
+	parser.add_argument('--restart', action='store_true', help='ignore the checkpoints of earlier runs')
+	args = parser.parse_args(argv)
+	failed = backfill(args.start, args.chunk_days, args.workers, args.views, args.tables, args.restart)
+	return 1 if failed else 0
+
+# A table is fresh when yesterday has been ingested and the last successful run is no older than two intervals.
+def get_data_freshness():
+	with db_pool.connection() as conn:
+		cur = conn.cursor()
+
+		ensure_ingest_status(cur)
+		cur.execute("select table_name, last_attempt, last_success, last_error, latest_date, rows_ingested, extract(epoch from now() - last_success) from ingest_status")
+		rows = cur.fetchall()
+
+		cur.close()
+	yesterday = get_date_list(1)[0]
+	status = {}
+	for table_name, last_attempt, last_success, last_error, latest_date, rows_ingested, age in rows:
+		status[table_name] = {
+			'last_attempt': None if last_attempt is None else last_attempt.isoformat(),
+			'last_success': None if last_success is None else last_success.isoformat(),
+			'last_error': last_error,
+			'latest_date': latest_date,
+			'rows_ingested': rows_ingested,
+			'fresh': latest_date is not None and latest_date >= yesterday and age is not None and float(age) <= 2*INGEST_INTERVAL
+		}
+	for view in VIEW_IDS:
+		for table in time_series_tables:
+			status.setdefault(get_table_name(table, view), {'fresh': False})
+	return {'mode': INGEST_MODE, 'fresh': all(i['fresh'] for i in status.values()), 'tables': status}
+
+@app.server.route('/status/freshness')
+def data_freshness():
+	return flask.jsonify(get_data_freshness())
+
+@app.server.route('/realtime/summary')
+def realtime_summary():
+	view = flask.request.args.get('view', ALL_VIEWS)
+	if view != ALL_VIEWS and view not in VIEW_IDS:
+		flask.abort(404)
+	windows = realtime_history.summary(view)
+	return flask.jsonify({'windows': dict((str(minutes), window) for minutes, window in windows.items()), 'series': realtime_history.series(view)})
+
+@app.server.route('/metrics')
+def metrics_endpoint():
+	for state, value in db_pool.status().items():
+		metrics.set('db_pool_connections', value, state=state)
+	for kind, value in async_access.status().items():
+		metrics.set('access_calls_in_flight', value, kind=kind)
+	for cache in (report_cache, figure_cache):
+		metrics.set('cache_bytes', cache.size, cache=cache.name)
+	for view in VIEW_IDS:
+		get_ga_limiter(view)
+	with ga_limiters_lock:
+		limiters = list(ga_limiters.items())
+	for view, limiter in limiters:
+		metrics.set('ga_quota_remaining', limiter.remaining(), view=view or 'none')
+	return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Loads the lazily imported modules and builds what every worker needs the same way, so a gunicorn master running with
+# preload_app (see gunicorn.conf.py) does it once and the forked workers share the memory.
+def prewarm():
+	load_modules(np, pd, pio, subplots, discovery, service_account, psycopg2)
+	serve_layout()
+	get_overview_skeleton()
+	get_template('plotly_dark')
+
+# Run in every worker forked from a preloading master. Threads do not survive the fork, so background work starts here.
+def after_fork():
+	db_pool.reset_after_fork()
+	async_access.reset_after_fork()
+	start_background()
+
+# Background work starts only in a process that serves the dashboard, never on import, so `python app.py ingest` and
+# `backfill`, the benchmarks or a shell importing the module do not run a second scheduler next to their own work.
+def start_background():
+	if INGEST_MODE == 'thread':
+		ingest_scheduler.start()
+
 if __name__ == '__main__':
-	app.run_server(debug=True)
\ No newline at end of file
+	if sys.argv[1:] == ['ingest']:
+		logging.basicConfig(level=logging.INFO)
+		ingest_scheduler.run_forever()
+	elif sys.argv[1:2] == ['backfill']:
+		logging.basicConfig(level=logging.INFO)
+		sys.exit(backfill_main(sys.argv[2:]))
+	else:
+		# The debug reloader's parent process only watches the files; the child it starts serves the app.
+		if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+			start_background()
+		app.run_server(debug=True)
\ No newline at end of file
@@ -0,0 +1,33 @@
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    live: {
+        // Replaces the marker data of the live map in place and keeps the layout that is already on the page.
+        apply_delta: function(delta, figure) {
+            if (!delta || !figure || !figure.data || figure.data.length === 0) {
+                return window.dash_clientside.no_update;
+            }
+            var trace = Object.assign({}, figure.data[0], {
+                lon: delta.lon,
+                lat: delta.lat,
+                text: delta.text,
+                marker: Object.assign({}, figure.data[0].marker, delta.marker)
+            });
+            return Object.assign({}, figure, {data: [trace].concat(figure.data.slice(1))});
+        }
+    },
+    navigation: {
+        // Tabs of the selected mode and the tab to open, both in one update.
+        set_tabs: function(mode, navigation) {
+            if (!mode || !navigation || !navigation.tabs[mode]) {
+                return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            return [navigation.tabs[mode], navigation.values[mode]];
+        },
+        // The controls and empty graphs of a tab; their data callbacks run once they are on the page.
+        render_content: function(tab, navigation) {
+            if (!tab || !navigation || !navigation.contents[tab]) {
+                return window.dash_clientside.no_update;
+            }
+            return navigation.contents[tab];
+        }
+    }
+});
@@ -0,0 +1,514 @@
+# Offline benchmarks for the dashboard's panel builders and callbacks.
+#
+#	python bench.py run --sizes 1000,10000,100000 --repeat 5 --output before.json
+#	python bench.py compare before.json after.json --threshold 0.1
+#	python bench.py startup --budget 0.75
+#
+# GA Reporting and Realtime are replaced by a synthetic service and Postgres by a SQLite file, so no credentials or
+# network are needed. Callbacks run in inline mode: the first pass fetches from the fake service and fills the database
+# and the local store, the timed passes then read what an ingested deployment would read.
+#
+# Every panel builder and callback is timed on its own. The views_* cases run with two views selected together, the
+# db_down_* cases with the database refusing connections, and shared_prune trims a full disk cache.
+
+import os
+import sys
+import json
+import shutil
+import atexit
+import time
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+import statistics
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+workdir = tempfile.mkdtemp(prefix='traffic-bench-')
+atexit.register(shutil.rmtree, workdir, True)
+os.environ['INGEST_MODE'] = 'inline'
+os.environ.setdefault('STORE_DIR', os.path.join(workdir, 'store'))
+os.environ.setdefault('DISCOVERY_CACHE_DIR', os.path.join(workdir, 'discovery'))
+os.environ.setdefault('SHARED_CACHE_DIR', os.path.join(workdir, 'shared'))
+# The fake service has no quota; keep the GA rate limiter out of the timings.
+os.environ.setdefault('GA_QPS', '1000000')
+os.environ.setdefault('GA_BURST', '1000000')
+os.environ.setdefault('GA_DAILY_QUOTA', '1000000000')
+
+import numpy as np
+import pandas as pd
+import app
+
+countries = ['India', 'United States', 'Germany', 'Brazil', 'Japan', 'Nigeria', 'Australia', 'Canada']
+dimension_values = {
+	'ga:userType': ['New Visitor', 'Returning Visitor'],
+	'ga:operatingSystem': ['Android', 'Windows', 'iOS', 'Macintosh', 'Linux'],
+	'ga:browser': ['Chrome', 'Safari', 'Firefox', 'Edge'],
+	'ga:deviceCategory': ['mobile', 'desktop', 'tablet'],
+	'ga:source': ['google', '(direct)', 'facebook', 'bing', 'reddit'],
+	'ga:medium': ['organic', '(none)', 'referral', 'cpc'],
+	'rt:medium': ['ORGANIC', 'DIRECT', 'REFERRAL'],
+	'rt:source': ['google', '(direct)', 'facebook']
+}
+float_metrics = ['ga:bounceRate', 'ga:avgSessionDuration', 'ga:pageviewsPerSession', 'ga:avgTimeOnPage']
+
+def get_date(value):
+	if value == 'today':
+		return datetime.today()
+	if value == 'yesterday':
+		return datetime.today() - timedelta(days = 1)
+	return datetime.strptime(value, '%Y-%m-%d')
+
+# Column values for `size` rows of one dimension; places are spread over the globe so the geo grid has work to do.
+def get_dimension_column(name, size, rng):
+	if name in ('ga:longitude', 'rt:longitude'):
+		return ['{0:.4f}'.format(i) for i in rng.uniform(-180, 180, size)]
+	if name in ('ga:latitude', 'rt:latitude'):
+		return ['{0:.4f}'.format(i) for i in rng.uniform(-60, 70, size)]
+	if name in ('ga:country', 'rt:country'):
+		return [countries[i] for i in rng.integers(0, len(countries), size)]
+	if name in ('ga:region', 'rt:region'):
+		return ['Region {0}'.format(i) for i in rng.integers(0, 200, size)]
+	if name in ('ga:city', 'rt:city'):
+		return ['City {0}'.format(i) for i in range(size)]
+	values = dimension_values.get(name, ['(not set)'])
+	return [values[i % len(values)] for i in range(size)]
+
+# Carries the method, uri and body googleapiclient's HttpRequest has, which is what identical requests are coalesced on.
+class Request:
+	def __init__(self, execute, uri = None, body = None):
+		self.execute = execute
+		self.method = 'POST' if body is not None else 'GET'
+		self.uri = uri
+		self.body = body
+
+# Stands in for both googleapiclient services: reports().batchGet() for Reporting v4, data().realtime().get() and the
+# management listings for v3. Responses are generated once per request body so timed runs measure the dashboard only.
+class FakeService:
+	def __init__(self, geo_rows, realtime_rows, seed = 0):
+		self.geo_rows = geo_rows
+		self.realtime_rows = realtime_rows
+		self.seed = seed
+		self.responses = {}
+		self.calls = 0
+
+	def reports(self):
+		return self
+
+	def batchGet(self, body):
+		return Request(lambda: self.get_response(body), 'reports:batchGet', json.dumps(body, sort_keys = True))
+
+	def get_response(self, body):
+		self.calls += 1
+		key = json.dumps(body, sort_keys = True)
+		if key not in self.responses:
+			self.responses[key] = {'reports': [self.get_report(i) for i in body['reportRequests']]}
+		return self.responses[key]
+
+	def get_report(self, request):
+		rng = np.random.default_rng(self.seed)
+		dimensions = [i['name'] for i in request.get('dimensions', [])]
+		metrics = [i['expression'] for i in request.get('metrics', [])]
+		if 'ga:date' in dimensions:
+			start, end = [get_date(request['dateRanges'][0][i]) for i in ('startDate', 'endDate')]
+			days = [i.strftime('%Y%m%d') for i in pd.date_range(start, end)]
+			other = [dimension_values.get(i, ['(not set)']) for i in dimensions[1:]]
+			columns = [[d for d in days for v in (other[0] if other else [None])]]
+			if other:
+				columns.append([v for d in days for v in other[0]])
+			size = len(columns[0])
+		else:
+			size = self.geo_rows if 'ga:longitude' in dimensions else len(dimension_values.get(dimensions[0], [None])) if dimensions else 1
+			columns = [get_dimension_column(i, size, rng) for i in dimensions]
+		values = [['{0:.2f}'.format(v) for v in rng.uniform(0, 100, size)] if i in float_metrics else [str(v) for v in rng.integers(0, 50, size)] for i in metrics]
+		rows = [{'dimensions': [c[n] for c in columns], 'metrics': [{'values': [v[n] for v in values]}]} for n in range(size)]
+		start = int(request.get('pageToken') or 0)
+		page_size = int(request.get('pageSize', 1000))
+		report = {
+			'columnHeader': {
+				'dimensions': dimensions,
+				'metricHeader': {'metricHeaderEntries': [{'name': i, 'type': 'FLOAT' if i in float_metrics else 'INTEGER'} for i in metrics]}
+			},
+			'data': {'rows': rows[start:start + page_size], 'rowCount': size}
+		}
+		if start + page_size < size:
+			report['nextPageToken'] = str(start + page_size)
+		return report
+
+	def management(self):
+		return self
+
+	def accounts(self):
+		return self
+
+	def webproperties(self):
+		return self
+
+	def profiles(self):
+		return self
+
+	def list(self, **kwargs):
+		return Request(lambda: {'items': [{'id': '1'}]})
+
+	def data(self):
+		return self
+
+	def realtime(self):
+		return self
+
+	def get(self, ids, metrics, dimensions):
+		return Request(lambda: self.get_realtime(dimensions), 'data/realtime?ids={0}&metrics={1}&dimensions={2}'.format(ids, metrics, dimensions))
+
+	def get_realtime(self, dimensions):
+		self.calls += 1
+		if 'realtime' not in self.responses:
+			rng = np.random.default_rng(self.seed)
+			columns = [get_dimension_column(i.strip(), self.realtime_rows, rng) for i in dimensions.split(',')]
+			columns.append([str(i) for i in rng.integers(1, 5, self.realtime_rows)])
+			self.responses['realtime'] = {'rows': [list(row) for row in zip(*columns)]}
+		return self.responses['realtime']
+
+class FakeCursor:
+	def __init__(self, connection):
+		self.connection = connection
+		self.cursor = connection.db.cursor()
+
+	def execute(self, query, params = ()):
+		self.cursor.execute(query.replace('%s', '?'), params or ())
+
+	def fetchone(self):
+		return self.cursor.fetchone()
+
+	def fetchall(self):
+		return self.cursor.fetchall()
+
+	def close(self):
+		self.cursor.close()
+
+# psycopg2 connection over a SQLite file, with the few Postgres functions the app calls registered as SQL functions.
+class FakeConnection:
+	closed = 0
+
+	def __init__(self, path):
+		self.path = path
+		self.db = sqlite3.connect(path, timeout = 30, check_same_thread = False)
+		self.db.create_function('now', 0, lambda: datetime.now().isoformat(' '))
+		self.db.create_function('pg_try_advisory_xact_lock', 1, lambda key: 1)
+		self.db.create_function('pg_advisory_xact_lock', 1, lambda key: 1)
+		self.db.create_function('to_regclass', 1, self.to_regclass)
+
+	def to_regclass(self, name):
+		with sqlite3.connect(self.path) as db:
+			return name if db.execute("select 1 from sqlite_master where name = ?", (name,)).fetchone() else None
+
+	def cursor(self):
+		return FakeCursor(self)
+
+	def commit(self):
+		self.db.commit()
+
+	def rollback(self):
+		self.db.rollback()
+
+	def close(self):
+		self.db.close()
+		self.closed = 1
+
+def setup(geo_rows, realtime_rows):
+	path = os.path.join(workdir, 'bench-{0}.sqlite'.format(geo_rows))
+	db = sqlite3.connect(path)
+	db.execute('pragma journal_mode = wal')
+	for table, spec in app.time_series_tables.items():
+		db.execute('create table if not exists {0}({1})'.format(table, ', '.join(i + ' text' for i in spec['columns'])))
+	db.commit()
+	db.close()
+	service = FakeService(geo_rows, realtime_rows)
+	app.get_service = lambda api_name, api_version, scopes, key_file_location: service
+	app.db_pool.closeall()
+	app.db_pool.connect = lambda: FakeConnection(path)
+	app.date_indexes_ready.clear()
+	app.rollups_ready.clear()
+	app.ingest_status_ready = False
+	app.realtime_poller.profile_ids = None
+	cells.clear()
+	reset()
+	return service
+
+def reset():
+	app.report_cache.invalidate()
+	app.figure_cache.invalidate()
+	app.realtime_poller.fetched_at = 0
+
+# What another worker sees: its own caches are empty but the shared backend still holds what this one stored.
+def drop_local():
+	for cache in (app.report_cache, app.figure_cache):
+		cache.entries.clear()
+		cache.size = 0
+
+cells = {}
+
+# A geo cluster to drill into, taken from the first marker of the clustered figure of GEN, SRC or MDM and kept for the
+# size being run, so drilling in does not also time drawing the clusters.
+def get_cell(option = 'GEN'):
+	if option not in cells:
+		figure = app.get_plot_general() if option == 'GEN' else app.update_traffic_graph(option)
+		cell = (figure['data'][0].get('customdata') or [None])[0]
+		cells[option] = None if cell is None else tuple(cell)
+	return cells[option]
+
+def get_click(option):
+	cell = get_cell(option)
+	return {'points': [{'customdata': None if cell is None else list(cell)}]}
+
+def get_report(report, *args):
+	return report(*(args + (app.VIEW_ID,))).copy()
+
+# Two views selected together, the original one and one with tables of its own; the cases then ask for ALL_VIEWS.
+@contextmanager
+def multi_view():
+	view_ids, profile_ids = app.VIEW_IDS, app.realtime_poller.profile_ids
+	app.VIEW_IDS = [app.VIEW_ID, 'bench2']
+	app.realtime_poller.profile_ids = app.VIEW_IDS
+	try:
+		yield
+	finally:
+		app.VIEW_IDS = view_ids
+		app.realtime_poller.profile_ids = profile_ids
+
+# Postgres refusing connections while callbacks only read and the local store is off, so every panel that needs the
+# database fails and the overview has to come back with what is left. The panels' errors are not logged meanwhile.
+@contextmanager
+def db_down():
+	connect, ingest_mode, column_store = app.db_pool.connect, app.INGEST_MODE, app.column_store
+	def refuse():
+		raise sqlite3.OperationalError('connection refused')
+	app.db_pool.closeall()
+	app.db_pool.connect = refuse
+	app.INGEST_MODE = 'process'
+	app.column_store = None
+	app.logger.disabled = True
+	try:
+		yield
+	finally:
+		app.db_pool.connect = connect
+		app.INGEST_MODE = ingest_mode
+		app.column_store = column_store
+		app.logger.disabled = False
+
+def within(context, function):
+	def run():
+		with context():
+			return function()
+	return run
+
+prune_backend = []
+
+# A disk cache with 2000 entries of 1 KB, a quarter of them expired, and a generation, to be pruned to a fifth of it.
+def fill_prune():
+	backend = app.DiskCacheBackend(os.path.join(workdir, 'prune'), float('inf'))
+	app.SharedCache(backend, 'bench', 1).get_generation()
+	data = b'x'*1024
+	for i in range(2000):
+		backend.set('bench:{0}'.format(i), data, -1 if i % 4 == 0 else 3600)
+	backend.max_bytes = 400*1024
+	prune_backend[:] = [backend]
+
+def prune():
+	if not prune_backend:
+		fill_prune()
+	prune_backend[0].prune()
+
+def get_benchmarks():
+	view = app.VIEW_ID
+	return [
+		('overview_10d', lambda: app.subplot_overview(10), reset),
+		('overview_365d', lambda: app.subplot_overview(365), reset),
+		('overview_cached', lambda: app.subplot_overview(10), None),
+		('general', lambda: app.get_plot_general(), app.figure_cache.invalidate),
+		('general_drill', lambda: app.get_plot_general(get_cell()), app.figure_cache.invalidate),
+		('general_shared', lambda: app.get_plot_general(), drop_local),
+		('traffic_source', lambda: app.update_traffic_graph('SRC'), app.figure_cache.invalidate),
+		('traffic_medium', lambda: app.update_traffic_graph('MDM'), app.figure_cache.invalidate),
+		('general_report', lambda: app.get_value_general(), app.report_cache.invalidate),
+		('live_markers', lambda: app.update_live_markers(1, None, app.DEFAULT_VIEW), reset),
+		('live_graph', lambda: app.update_live_graph(1, app.DEFAULT_VIEW), reset),
+		('panel_bandwidth', lambda: app.plot_bandwidth(10, view), reset),
+		('panel_system', lambda: app.plot_system(10, view), reset),
+		('panel_sessions', lambda: app.plot_sessions(10, view), reset),
+		('panel_pageviews', lambda: app.plot_pageviews(10, view), reset),
+		('panel_users', lambda: app.plot_users(view), reset),
+		('panel_overall', lambda: app.plot_overall(view), reset),
+		('panel_general', lambda: app.plot_general(get_report(app.get_value_general)), None),
+		('panel_source', lambda: app.plot_traffic('SRC', get_report(app.get_value_traffic, 'ga:source', tuple(app.column_names_source_geo))), None),
+		('panel_medium', lambda: app.plot_traffic('MDM', get_report(app.get_value_traffic, 'ga:medium', tuple(app.column_names_medium_geo))), None),
+		('cb_overview', lambda: app.update_overview(10, view), reset),
+		('cb_general_tab', lambda: app.update_general_or_traffic_source('GEN', view), app.figure_cache.invalidate),
+		('cb_source_tab', lambda: app.update_general_or_traffic_source('TS', view), app.figure_cache.invalidate),
+		('cb_medium_tab', lambda: app.update_general_or_traffic_source('TM', view), app.figure_cache.invalidate),
+		('cb_drill_general', lambda: app.drill_general(get_click('GEN'), view), app.figure_cache.invalidate),
+		('cb_drill_source', lambda: app.drill_source(get_click('SRC'), view), app.figure_cache.invalidate),
+		('cb_drill_medium', lambda: app.drill_medium(get_click('MDM'), view), app.figure_cache.invalidate),
+		('cb_go_live', lambda: app.update_manually_or_go_live('GL'), None),
+		('cb_update_manually', lambda: app.update_manually_or_go_live('UM'), None),
+		('cb_live_markers', lambda: app.update_live_markers(1, None, view), reset),
+		('cb_live_graph', lambda: app.update_live_graph(1, view), reset),
+		('views_overview', within(multi_view, lambda: app.update_overview(10, app.ALL_VIEWS)), reset),
+		('views_overview_365d', within(multi_view, lambda: app.update_overview(365, app.ALL_VIEWS)), reset),
+		('views_general_tab', within(multi_view, lambda: app.update_general_or_traffic_source('GEN', app.ALL_VIEWS)), reset),
+		('views_live_markers', within(multi_view, lambda: app.update_live_markers(1, None, app.ALL_VIEWS)), reset),
+		('db_down_overview', within(db_down, lambda: app.update_overview(10, view)), reset),
+		('db_down_overview_365d', within(db_down, lambda: app.update_overview(365, view)), reset),
+		('shared_prune', prune, fill_prune)
+	]
+
+def run_benchmark(function, before, repeat):
+	runs = []
+	for i in range(repeat):
+		if before is not None:
+			before()
+		start = time.perf_counter()
+		function()
+		runs.append(time.perf_counter() - start)
+	return {'min': min(runs), 'median': statistics.median(runs), 'mean': statistics.mean(runs), 'runs': runs}
+
+def run(args):
+	sizes = [int(i) for i in args.sizes.split(',')]
+	selected = set(args.only.split(',')) if args.only else None
+	results = {}
+	for size in sizes:
+		service = setup(size, min(size, args.realtime_rows))
+		for name, function, before in get_benchmarks():
+			if selected is not None and name not in selected:
+				continue
+			# The untimed first call fills the fake responses, the database and the store.
+			function()
+			calls = service.calls
+			result = run_benchmark(function, before, args.repeat)
+			result['ga_calls'] = (service.calls - calls) / args.repeat
+			results.setdefault(name, {})[str(size)] = result
+			print('{0:<22} {1:>7} rows  min {2:8.1f} ms  median {3:8.1f} ms'.format(name, size, 1000*result['min'], 1000*result['median']))
+	output = {
+		'meta': {
+			'time': datetime.now().isoformat(),
+			'python': platform.python_version(),
+			'numpy': np.__version__,
+			'pandas': pd.__version__,
+			'store': bool(app.STORE_DIR),
+			'sizes': sizes,
+			'repeat': args.repeat
+		},
+		'results': results
+	}
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(output, f, indent = 1)
+	return 0
+
+# Median of every benchmark present in both files; a ratio above 1 + threshold counts as a regression.
+def compare(args):
+	with open(args.baseline) as f:
+		baseline = json.load(f)['results']
+	with open(args.current) as f:
+		current = json.load(f)['results']
+	regressions = 0
+	for name in sorted(set(baseline) & set(current)):
+		for size in sorted(set(baseline[name]) & set(current[name]), key = int):
+			before, after = baseline[name][size]['median'], current[name][size]['median']
+			ratio = after / before if before > 0 else float('inf')
+			flag = ''
+			if ratio > 1 + args.threshold:
+				flag = '  REGRESSION'
+				regressions += 1
+			print('{0:<22} {1:>7} rows  {2:8.1f} ms -> {3:8.1f} ms  x{4:.2f}{5}'.format(name, size, 1000*before, 1000*after, ratio, flag))
+	return 1 if regressions else 0
+
+# The modules app.py defers; importing it must not load any of them.
+deferred_modules = ['numpy', 'pandas', 'plotly.io', 'plotly.subplots', 'googleapiclient.discovery', 'oauth2client.service_account', 'psycopg2']
+
+startup_script = '''
+import sys
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+loaded = [i for i in {0!r} if i in sys.modules]
+app.prewarm()
+print(imported - start, time.perf_counter() - imported, *loaded)
+'''.format(deferred_modules)
+
+# The environment of each configuration the import is checked in, on top of the bench's own: the default one, where the
+# ingest scheduler runs in the web process, and a web process next to a separate `app.py ingest`.
+startup_configs = [
+	('default', {'INGEST_MODE': None}),
+	('ingest process', {'INGEST_MODE': 'process'})
+]
+
+# Import time of app.py in a fresh interpreter, best of `repeat`, in every configuration. Over the budget, or when the
+# import loaded a deferred module, the slowest imports are listed.
+def startup(args):
+	cwd = os.path.dirname(os.path.abspath(__file__))
+	failed = 0
+	for config, overrides in startup_configs:
+		env = dict(os.environ, PYTHONWARNINGS = 'ignore')
+		for name, value in overrides.items():
+			if value is None:
+				env.pop(name, None)
+			else:
+				env[name] = value
+		if not startup_config(config, env, cwd, args):
+			failed += 1
+	return 1 if failed else 0
+
+def startup_config(config, env, cwd, args):
+	runs = []
+	for i in range(args.repeat):
+		output = subprocess.check_output([sys.executable, '-c', startup_script], env = env, cwd = cwd).split()
+		runs.append([float(i) for i in output[:2]] + [i.decode() for i in output[2:]])
+	imported = min(i[0] for i in runs)
+	prewarmed = min(i[1] for i in runs)
+	loaded = sorted(set(i for run in runs for i in run[2:]))
+	print('{0:<16} import {1:8.1f} ms  prewarm {2:8.1f} ms  budget {3:8.1f} ms'.format(config, 1000*imported, 1000*prewarmed, 1000*args.budget))
+	if loaded:
+		print('{0:<16} import loaded deferred modules: {1}'.format(config, ', '.join(loaded)))
+	if imported <= args.budget and not loaded:
+		return True
+	profile = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], env = env, cwd = cwd, stderr = subprocess.PIPE, stdout = subprocess.DEVNULL, universal_newlines = True).stderr
+	imports = []
+	for line in profile.splitlines():
+		fields = line.split('|')
+		if line.startswith('import time:') and fields[1].strip().isdigit():
+			imports.append((int(fields[1]), fields[2].rstrip()))
+	print('slowest imports (cumulative):')
+	for cumulative, name in sorted(imports, reverse = True)[:10]:
+		print('{0:8.1f} ms {1}'.format(cumulative/1000, name))
+	return False
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(description = 'Offline benchmarks for the traffic dashboard.')
+	commands = parser.add_subparsers(dest = 'command')
+	parser_run = commands.add_parser('run', help = 'time the panel builders and callbacks')
+	parser_run.add_argument('--sizes', default = '100,1000,10000,100000', help = 'comma separated geo row counts')
+	parser_run.add_argument('--realtime-rows', type = int, default = 10000, help = 'upper bound on real-time rows')
+	parser_run.add_argument('--repeat', type = int, default = 5)
+	parser_run.add_argument('--only', help = 'comma separated benchmark names')
+	parser_run.add_argument('--output', '-o', help = 'write the results as JSON')
+	parser_compare = commands.add_parser('compare', help = 'compare two result files')
+	parser_compare.add_argument('baseline')
+	parser_compare.add_argument('current')
+	parser_compare.add_argument('--threshold', type = float, default = 0.1, help = 'allowed slowdown of the median')
+	parser_startup = commands.add_parser('startup', help = 'check the import time of app.py against a budget')
+	parser_startup.add_argument('--budget', type = float, default = float(os.environ.get('STARTUP_BUDGET', '0.75')), help = 'seconds')
+	parser_startup.add_argument('--repeat', type = int, default = 5)
+	args = parser.parse_args(argv)
+	if args.command == 'compare':
+		return compare(args)
+	if args.command == 'startup':
+		return startup(args)
+	if args.command is None:
+		args = parser.parse_args(['run'] + (argv or sys.argv[1:]))
+	return run(args)
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,21 @@
+# gunicorn -c gunicorn.conf.py
+#
+# The master imports the app once and prewarms it before forking, so workers boot without importing pandas, plotly or
+# googleapiclient themselves and share those pages with the master.
+import os
+
+wsgi_app = 'app:server'
+bind = '0.0.0.0:' + os.environ.get('PORT', '8000')
+# Set in the environment too, so the app divides the GA quota between this many workers.
+workers = int(os.environ.setdefault('WEB_CONCURRENCY', '2'))
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+preload_app = True
+
+def when_ready(server):
+	import app
+	app.prewarm()
+
+# Importing the app starts no threads; each worker starts its own, the ingest scheduler among them, once it is forked.
+def post_fork(server, worker):
+	import app
+	app.after_fork()
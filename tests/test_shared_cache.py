@@ -0,0 +1,22 @@
+import app
+
+def get_caches():
+	backend = app.MemoryCacheBackend()
+	return [app.TTLCache(1 << 20, 'test', app.SharedCache(backend, 'test', 0)) for i in range(2)]
+
+def test_value_stored_by_one_cache_is_loaded_by_another():
+	first, second = get_caches()
+	version = first.set('key', {'users': 42}, 60)
+	assert second.get_versioned('key', lambda: {'users': 0}, 60) == ({'users': 42}, version)
+
+def test_invalidating_one_cache_is_seen_by_another():
+	first, second = get_caches()
+	first.set('key', 1, 60)
+	assert second.get_or_compute('key', lambda: 2, 60) == 1
+	first.invalidate()
+	assert second.get_or_compute('key', lambda: 2, 60) == 2
+	assert first.get_or_compute('key', lambda: 3, 60) == 2
+
+def test_versions_are_unique():
+	first, second = get_caches()
+	assert len({cache.set('key', 1, 60) for cache in (first, second) for i in range(100)}) == 200